@@ -1,243 +1,917 @@
+import base64
+import contextlib
+import contextvars
+import functools
+import gzip
 import json
+import math
 import os
-import psycopg2
-import bcrypt
-import jwt
-from datetime import datetime, timedelta
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
 
-def handler(event: dict, context) -> dict:
-    """API для регистрации и авторизации пользователей"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Общий каркас функций. Блок до "Конец общего каркаса" одинаковый в auth, posts
+# и shorts: каждая функция деплоится отдельной папкой, поэтому код не выносится
+# в общий пакет. Расхождение копий ловит bench/check_shared.py. maintenance
+# запускается таймером и каркасом не пользуется.
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к его атрибуту.
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    body = json.loads(event.get('body', '{}'))
-    action = body.get('action')
-    
-    db_url = os.environ.get('DATABASE_URL')
-    jwt_secret = os.environ.get('JWT_SECRET', 'fallback-secret')
-    
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor()
+    psycopg2 и jwt не нужны preflight-запросам и ответам из кэша в памяти,
+    поэтому холодный старт контейнера их не ждёт.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
     
+    def __getattr__(self, attr: str):
+        return getattr(__import__(self._name), attr)
+
+psycopg2 = LazyModule('psycopg2')
+jwt = LazyModule('jwt')
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '2'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_pool = []
+_pool_lock = threading.Lock()
+pool_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'discarded': 0}
+
+def _close_quietly(conn):
     try:
-        if action == 'register':
-            username = body.get('username')
-            email = body.get('email')
-            password = body.get('password')
-            
-            if not username or not email or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required fields'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
-            if cur.fetchone():
-                return {
-                    'statusCode': 409,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User already exists'}),
-                    'isBase64Encoded': False
-                }
-            
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            
-            cur.execute(
-                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id, username, email, avatar, banner, bio",
-                (username, email, password_hash)
-            )
-            user_data = cur.fetchone()
-            conn.commit()
-            
-            token = jwt.encode({
-                'user_id': user_data[0],
-                'username': user_data[1],
-                'exp': datetime.utcnow() + timedelta(days=30)
-            }, jwt_secret, algorithm='HS256')
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'token': token,
-                    'user': {
-                        'id': user_data[0],
-                        'username': user_data[1],
-                        'email': user_data[2],
-                        'avatar': user_data[3],
-                        'banner': user_data[4],
-                        'bio': user_data[5]
-                    }
-                }),
-                'isBase64Encoded': False
-            }
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def acquire_connection():
+    """Взять соединение из пула тёплого контейнера или открыть новое"""
+    while True:
+        with _pool_lock:
+            if not _pool:
+                break
+            conn, released_at = _pool.pop()
         
-        elif action == 'login':
-            username = body.get('username')
-            password = body.get('password')
-            
-            if not username or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing credentials'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "SELECT id, username, email, password_hash, avatar, banner, bio FROM users WHERE username = %s OR email = %s",
-                (username, username)
-            )
-            user_data = cur.fetchone()
-            
-            if not user_data:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid credentials'}),
-                    'isBase64Encoded': False
-                }
-            
-            try:
-                password_valid = bcrypt.checkpw(password.encode('utf-8'), user_data[3].encode('utf-8'))
-            except ValueError:
-                password_valid = False
-            
-            if not password_valid:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid credentials'}),
-                    'isBase64Encoded': False
-                }
-            
-            token = jwt.encode({
-                'user_id': user_data[0],
-                'username': user_data[1],
-                'exp': datetime.utcnow() + timedelta(days=30)
-            }, jwt_secret, algorithm='HS256')
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'token': token,
-                    'user': {
-                        'id': user_data[0],
-                        'username': user_data[1],
-                        'email': user_data[2],
-                        'avatar': user_data[4],
-                        'banner': user_data[5],
-                        'bio': user_data[6]
-                    }
-                }),
-                'isBase64Encoded': False
-            }
+        if conn.closed:
+            pool_stats['stale'] += 1
+            continue
         
-        elif action == 'verify':
-            auth_header = event.get('headers', {}).get('X-Authorization', '')
-            if not auth_header.startswith('Bearer '):
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'No token provided'}),
-                    'isBase64Encoded': False
-                }
-            
-            token = auth_header.replace('Bearer ', '')
-            
+        if time.monotonic() - released_at > DB_POOL_PING_AFTER:
             try:
-                payload = jwt.decode(token, jwt_secret, algorithms=['HS256'])
-                user_id = payload.get('user_id')
-                
-                cur.execute(
-                    "SELECT id, username, email, avatar, banner, bio, phone FROM users WHERE id = %s",
-                    (user_id,)
-                )
-                user_data = cur.fetchone()
-                
-                if not user_data:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'User not found'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "SELECT COUNT(*) FROM subscriptions WHERE following_id = %s",
-                    (user_id,)
-                )
-                followers = cur.fetchone()[0]
-                
-                cur.execute(
-                    "SELECT COUNT(*) FROM subscriptions WHERE follower_id = %s",
-                    (user_id,)
-                )
-                following = cur.fetchone()[0]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': {
-                            'id': user_data[0],
-                            'username': user_data[1],
-                            'email': user_data[2],
-                            'avatar': user_data[3],
-                            'banner': user_data[4],
-                            'bio': user_data[5],
-                            'phone': user_data[6],
-                            'followers': followers,
-                            'following': following
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            except jwt.ExpiredSignatureError:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Token expired'}),
-                    'isBase64Encoded': False
-                }
-            except jwt.InvalidTokenError:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid token'}),
-                    'isBase64Encoded': False
-                }
+                with conn.cursor() as ping:
+                    ping.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                pool_stats['stale'] += 1
+                _close_quietly(conn)
+                continue
         
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid action'}),
-                'isBase64Encoded': False
-            }
+        pool_stats['hits'] += 1
+        return conn
+    
+    pool_stats['misses'] += 1
+    return psycopg2.connect(
+        os.environ.get('DATABASE_URL'),
+        connect_timeout=5,
+        keepalives=1,
+        keepalives_idle=30
+    )
+
+def release_connection(conn):
+    """Вернуть соединение в пул, закрыв лишние и сломанные"""
+    if conn.closed:
+        return
+    
+    try:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _close_quietly(conn)
+        return
+    
+    with _pool_lock:
+        if len(_pool) < DB_POOL_SIZE:
+            _pool.append((conn, time.monotonic()))
+            return
+    
+    pool_stats['discarded'] += 1
+    _close_quietly(conn)
+
+JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback-secret')
+
+# Замеры запросов: строка JSON-лога на каждый вызов и, по желанию, Server-Timing
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_cold_start = True
+
+# Накопительные счётчики тёплого контейнера, которые попадают в строку лога каждого вызова
+trace_stats = {'pool': pool_stats}
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_VALUES_RE = re.compile(r'\([?, ]+\)(?:\s*,\s*\([?, ]+\))+')
+
+@functools.lru_cache(maxsize=256)
+def normalize_sql(query) -> str:
+    """Текст запроса без переносов и литералов, чтобы одинаковые запросы группировались"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    text = _SQL_LITERAL_RE.sub('?', ' '.join(str(query).split()))
+    return _SQL_VALUES_RE.sub('(?), ...', text)[:300]
+
+class Trace:
+    """Замеры одного вызова: время по этапам (db_connect, db, jwt, bcrypt, serialize) и запросы к БД"""
+    
+    def __init__(self, action: str, cold: bool):
+        self.action = action
+        self.cold = cold
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = []
+        self.total = 0.0
+    
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+    
+    def finish(self, context, response):
+        self.total = time.perf_counter() - self.started
+        if not TRACE_LOG:
+            return
+        print(json_dumps({
+            'type': 'request',
+            'function': getattr(context, 'function_name', None),
+            'requestId': getattr(context, 'request_id', None),
+            'action': self.action,
+            'status': response['statusCode'] if response else None,
+            'cold': self.cold,
+            'totalMs': round(self.total * 1000, 3),
+            'spans': {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()},
+            'queryCount': len(self.queries),
+            'queries': [{'sql': normalize_sql(query), 'ms': round(seconds * 1000, 3)} for query, seconds in self.queries],
+            'stats': {name: dict(values) for name, values in trace_stats.items()},
+        }), flush=True)
+    
+    def annotate(self, response: dict) -> dict:
+        """Добавить к ответу заголовок Server-Timing, если он включён"""
+        if not SERVER_TIMING:
+            return response
+        metrics = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.spans.items()]
+        metrics.append(f'total;dur={self.total * 1000:.3f}')
+        if self.cold:
+            metrics.append('cold')
+        headers = {**response['headers'], 'Server-Timing': ', '.join(metrics), 'Timing-Allow-Origin': '*'}
+        return {**response, 'headers': headers}
+
+@contextlib.contextmanager
+def timed(name: str):
+    """Засчитать время блока в этап name текущего вызова"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - started)
+
+@functools.cache
+def timed_cursor():
+    """Класс курсора, который записывает каждый запрос и его время в трассу текущего вызова.
+    
+    Создаётся при первом соединении: базовый класс тянет импорт psycopg2.
+    """
+    class TimedCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                trace = _current_trace.get()
+                if trace is not None:
+                    elapsed = time.perf_counter() - started
+                    trace.add('db', elapsed)
+                    trace.queries.append((query, elapsed))
+    return TimedCursor
+
+# Общие заголовки JSON-ответов: один объект на все ответы, не изменяется
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+if orjson is not None:
+    def json_dumps(data) -> str:
+        """Сериализовать тело ответа через orjson"""
+        with timed('serialize'):
+            return orjson.dumps(data, default=_json_default).decode('utf-8')
+else:
+    _json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+    
+    def json_dumps(data) -> str:
+        """Сериализовать тело ответа заранее созданным JSONEncoder"""
+        with timed('serialize'):
+            return _json_encoder.encode(data)
+
+def respond(status: int, payload=None, headers: dict = None) -> dict:
+    """Собрать ответ функции с JSON-телом"""
+    return {
+        'statusCode': status,
+        'headers': JSON_HEADERS if headers is None else {**JSON_HEADERS, **headers},
+        'body': '' if payload is None else json_dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def error(status: int, message: str, headers: dict = None) -> dict:
+    return respond(status, {'error': message}, headers)
+
+def rows_to_dicts(cur, rows: list) -> list:
+    """Превратить строки в словари по именам колонок из cur.description.
+    
+    Колонка с именем вида "author.id" попадает во вложенный объект author.
+    """
+    names = [column.name for column in cur.description]
+    if not any('.' in name for name in names):
+        return [dict(zip(names, row)) for row in rows]
+    
+    columns = [name.split('.', 1) for name in names]
+    items = []
+    for row in rows:
+        item = {}
+        for column, value in zip(columns, row):
+            if len(column) == 2:
+                item.setdefault(column[0], {})[column[1]] = value
+            else:
+                item[column[0]] = value
+        items.append(item)
+    return items
+
+class Request:
+    """Разобранный запрос к функции с ленивым соединением из пула"""
+    
+    def __init__(self, event: dict):
+        self.event = event
+        self.method = event.get('httpMethod', 'GET')
+        self.headers = event.get('headers') or {}
+        self.params = event.get('queryStringParameters') or {}
+        self.body = json.loads(event.get('body') or '{}') if self.method == 'POST' else {}
+        if not isinstance(self.body, dict):
+            raise ValueError('Request body must be a JSON object')
+        self.action = self.body.get('action')
+        self.token = None
+        self.user_id = None
+        self._conn = None
+        self._cur = None
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            with timed('db_connect'):
+                self._conn = acquire_connection()
+        return self._conn
+    
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = self.conn.cursor(cursor_factory=timed_cursor())
+        return self._cur
+    
+    def close(self):
+        if self._cur is not None:
+            self._cur.close()
+        if self._conn is not None:
+            release_connection(self._conn)
+
+def decode_token(req: Request):
+    """Проверить JWT из X-Authorization: (payload, None) или (None, ответ 401)"""
+    auth_header = req.headers.get('X-Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None, error(401, 'No token provided')
+    
+    try:
+        with timed('jwt'):
+            payload = jwt.decode(auth_header[len('Bearer '):], JWT_SECRET, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, error(401, 'Token expired')
+    except jwt.InvalidTokenError:
+        return None, error(401, 'Invalid token')
+    
+    if not payload.get('user_id'):
+        return None, error(401, 'Invalid token')
+    return payload, None
+
+def authenticated(route):
+    """Пустить в обработчик только запросы с валидным JWT (req.token, req.user_id)"""
+    @functools.wraps(route)
+    def wrapper(req: Request) -> dict:
+        payload, failure = decode_token(req)
+        if failure:
+            return failure
+        req.token = payload
+        req.user_id = payload['user_id']
+        return route(req)
+    return wrapper
+
+RATE_LIMIT_SCALE = float(os.environ.get('RATE_LIMIT_SCALE', '1'))
+RATE_LIMIT_LOCAL_KEYS = int(os.environ.get('RATE_LIMIT_LOCAL_KEYS', '10000'))
+
+class LocalRateStore:
+    """Token bucket в памяти тёплого контейнера: ключ -> [токены, время пополнения]"""
+    
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = {}
+    
+    def take(self, key: str, rate: float, burst: float, count: int = 1) -> tuple:
+        """Списать до count токенов: (сколько списано, секунд до следующего токена, если списаны не все)"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.pop(next(iter(self._buckets)))
+            bucket = self._buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        granted = min(count, int(tokens))
+        bucket[0], bucket[1] = tokens - granted, now
+        return granted, 0.0 if granted == count else (1 - bucket[0]) / rate
+
+class RedisRateStore:
+    """Общий для всех контейнеров token bucket в Redis.
+    
+    Пополнение и списание делает один Lua-скрипт, поэтому параллельные
+    контейнеры не теряют списания. Ошибки Redis пропускают запрос:
+    недоступный лимитер не должен ронять запись.
+    """
+    
+    SCRIPT = """
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local rate, burst, now, count = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + math.max(0, now - (tonumber(bucket[2]) or now)) * rate)
+        local granted = math.min(count, math.floor(tokens))
+        tokens = tokens - granted
+        local wait = 0
+        if granted < count then wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+        return {granted, tostring(wait)}
+    """
+    
+    def __init__(self, url: str, namespace: str):
+        import redis
+        client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self._take = client.register_script(self.SCRIPT)
+        self._errors = (redis.RedisError,)
+        self.namespace = namespace
+    
+    def take(self, key: str, rate: float, burst: float, count: int = 1) -> tuple:
+        try:
+            granted, wait = self._take(keys=[f'{self.namespace}:{key}'], args=[rate, burst, time.time(), count])
+            return int(granted), float(wait)
+        except self._errors:
+            return count, 0.0
+
+rate_stores = [LocalRateStore(RATE_LIMIT_LOCAL_KEYS)]
+if os.environ.get('RATE_LIMIT_REDIS_URL'):
+    rate_stores.append(RedisRateStore(os.environ['RATE_LIMIT_REDIS_URL'], 'rate'))
+
+# bucket -> (токенов в секунду, ёмкость, ключ); заполняет rate_limited
+rate_limits = {}
+
+def client_ip(req: Request) -> str:
+    """Адрес клиента: sourceIp шлюза, иначе последний адрес X-Forwarded-For.
+    
+    Первые адреса X-Forwarded-For присылает сам клиент и может подменить,
+    последний дописывает ближайший к функции прокси.
+    """
+    source_ip = ((req.event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    if source_ip:
+        return source_ip
+    forwarded = req.headers.get('X-Forwarded-For') or req.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.rsplit(',', 1)[-1].strip()
+    return 'unknown'
+
+def take_rate(req: Request, bucket: str, count: int = 1) -> tuple:
+    """Списать до count токенов bucket'а, объявленного через rate_limited:
+    (сколько действий разрешено, секунд до следующего токена)"""
+    rate, capacity, key = rate_limits[bucket]
+    if rate <= 0:
+        return count, 0.0
+    if key:
+        identity = key(req)
+    else:
+        identity = f'u{req.user_id}' if req.user_id else f'ip{client_ip(req)}'
+    max_wait = 0.0
+    for store in rate_stores:
+        count, wait = store.take(f'{bucket}:{identity}', rate, capacity, count)
+        max_wait = max(max_wait, wait)
+        if not count:
+            break
+    return count, max_wait
+
+def rate_limited(bucket: str, per_minute: float, burst: int, key=None):
+    """Ограничить частоту вызовов обработчика token bucket'ом на пользователя
+    (или на IP для анонимных запросов): при исчерпании — 429 с Retry-After.
+    
+    key(req) задаёт свой ключ bucket'а, например имя при входе. Сначала
+    проверяется локальный bucket, до общего хранилища доходят только
+    прошедшие его запросы. RATE_LIMIT_SCALE умножает лимиты, 0 отключает их.
+    Пакетные обработчики списывают токены того же bucket'а по числу
+    действий через take_rate.
+    """
+    rate_limits[bucket] = (per_minute * RATE_LIMIT_SCALE / 60, burst * RATE_LIMIT_SCALE, key)
+    
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(req: Request) -> dict:
+            allowed, wait = take_rate(req, bucket)
+            if not allowed:
+                return error(429, 'Too many requests', {'Retry-After': str(math.ceil(wait))})
+            return route(req)
+        return wrapper
+    return decorator
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+def accepted_encoding(req: Request):
+    """Лучшая из поддерживаемых клиентом кодировок по Accept-Encoding: 'br', 'gzip' или None"""
+    header = req.headers.get('Accept-Encoding') or req.headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.lower().split(','):
+        name, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(req: Request, response: dict) -> dict:
+    """Сжать тело ответа, если клиент это принимает и тело не меньше COMPRESS_MIN_BYTES"""
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded') or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = accepted_encoding(req)
+    if encoding is None:
+        return response
+    
+    with timed('compress'):
+        raw = body.encode('utf-8')
+        compressed = brotli.compress(raw, quality=5) if encoding == 'br' else gzip.compress(raw, compresslevel=6)
+    return {
+        **response,
+        'headers': {**response['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def preflight_response(routes: dict) -> dict:
+    """Ответ на OPTIONS для набора маршрутов: собирается один раз при загрузке модуля и не изменяется"""
+    methods = sorted({route_method for route_method, _ in routes})
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def dispatch(event: dict, context, routes: dict, preflight: dict) -> dict:
+    """Единая точка входа: готовый preflight, выбор обработчика по (метод, action), замеры, возврат соединения"""
+    global _cold_start
+    method = event.get('httpMethod', 'GET')
+    if method == 'OPTIONS':
+        return preflight
     
+    if method not in {route_method for route_method, _ in routes}:
+        return error(405, 'Method not allowed')
+    
+    try:
+        req = Request(event)
+    except ValueError:
+        return error(400, 'Invalid JSON')
+    
+    route = routes.get((method, req.action))
+    if route is None:
+        return error(400, 'Invalid action')
+    
+    trace = Trace(req.action or route.__name__, _cold_start)
+    _cold_start = False
+    token = _current_trace.set(trace)
+    response = None
+    try:
+        response = compress_response(req, route(req))
+    finally:
+        req.close()
+        _current_trace.reset(token)
+        trace.finish(context, response)
+    return trace.annotate(response)
+
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', '50'))
+FEED_MAX_PAGE_SIZE = int(os.environ.get('FEED_MAX_PAGE_SIZE', '100'))
+
+def encode_cursor(sort_key, item_id) -> str:
+    """Упаковать позицию в выдаче (ключ сортировки, id) в непрозрачный курсор"""
+    raw = f'{sort_key.isoformat() if isinstance(sort_key, datetime) else sort_key}|{item_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, parse_key=datetime.fromisoformat):
+    """Распаковать курсор в (ключ сортировки, id), None если курсор испорчен"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_key, item_id = raw.rsplit('|', 1)
+        return parse_key(sort_key), int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def get_page_size(params: dict):
+    """Размер страницы из параметра limit, None если он некорректен"""
+    try:
+        limit = int(params.get('limit') or FEED_PAGE_SIZE)
+    except ValueError:
+        return None
+    return min(max(limit, 1), FEED_MAX_PAGE_SIZE)
+
+# Конец общего каркаса
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', '2'))
+HASH_MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', '8'))
+
+BCRYPT_HASH_RE = re.compile(r'^\$2[aby]\$(\d{2})\$[./A-Za-z0-9]{53}$')
+
+# bcrypt и пул потоков нужны только register и login, остальные вызовы их не загружают
+bcrypt = LazyModule('bcrypt')
+
+@functools.cache
+def hash_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+
+_hash_slots = threading.BoundedSemaphore(HASH_MAX_PENDING)
+_hash_stats_lock = threading.Lock()
+hash_stats = {'submitted': 0, 'rejected': 0, 'pending': 0, 'max_pending': 0, 'rehashed': 0, 'not_bcrypt': 0}
+trace_stats['hash'] = hash_stats
+
+class HashPoolSaturated(Exception):
+    """Очередь хеширования паролей заполнена, запрос нужно отклонить с 429"""
+
+def run_hashing(fn, *args):
+    """Выполнить bcrypt в ограниченном пуле потоков.
+    
+    Одновременно в работе и очереди не больше HASH_MAX_PENDING задач, лишние
+    сразу получают HashPoolSaturated вместо ожидания до таймаута.
+    """
+    if not _hash_slots.acquire(blocking=False):
+        with _hash_stats_lock:
+            hash_stats['rejected'] += 1
+        raise HashPoolSaturated()
+    
+    with _hash_stats_lock:
+        hash_stats['submitted'] += 1
+        hash_stats['pending'] += 1
+        hash_stats['max_pending'] = max(hash_stats['max_pending'], hash_stats['pending'])
+    
+    try:
+        with timed('bcrypt'):
+            return hash_executor().submit(fn, *args).result()
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        with _hash_stats_lock:
+            hash_stats['pending'] -= 1
+        _hash_slots.release()
+
+def hash_password(password: str) -> str:
+    """Хеш пароля с текущей стоимостью BCRYPT_ROUNDS"""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return run_hashing(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+def check_password(password: str, password_hash: str):
+    """Проверить пароль, вернуть (верен, нужен_перехеш).
+    
+    Строки, не похожие на bcrypt-хеш (например, сидовый '$2b$10$dummyhash'),
+    просто не совпадают ни с одним паролем.
+    """
+    match = BCRYPT_HASH_RE.match(password_hash or '')
+    if not match:
+        with _hash_stats_lock:
+            hash_stats['not_bcrypt'] += 1
+        return False, False
+    
+    try:
+        valid = run_hashing(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        return False, False
+    return valid, valid and int(match.group(1)) != BCRYPT_ROUNDS
+
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '30'))
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '1024'))
+TIMELINE_BACKFILL = int(os.environ.get('TIMELINE_BACKFILL', '200'))
+
+_profile_cache = {}
+
+def get_cached_profile(payload: dict):
+    """Профиль для verify из кэша по (user_id, exp) токена"""
+    entry = _profile_cache.get((payload.get('user_id'), payload.get('exp')))
+    if entry and entry[0] > time.time():
+        return entry[1]
+    return None
+
+def cache_profile(payload: dict, profile: dict):
+    """Запомнить профиль на PROFILE_CACHE_TTL, но не дольше жизни токена"""
+    if len(_profile_cache) >= PROFILE_CACHE_SIZE:
+        _profile_cache.pop(next(iter(_profile_cache)))
+    expires_at = min(time.time() + PROFILE_CACHE_TTL, payload.get('exp') or 0)
+    _profile_cache[(payload.get('user_id'), payload.get('exp'))] = (expires_at, profile)
+
+def invalidate_profiles(*user_ids):
+    for key in [key for key in _profile_cache if key[0] in user_ids]:
+        del _profile_cache[key]
+
+def subscribe(cur, follower_id: int, following_id: int) -> tuple:
+    """Подписаться, обновив счётчики обоих пользователей и ленту подписчика.
+    
+    Свежие посты автора без fanout_on_read копируются в таймлайн подписчика,
+    чтобы лента подписок не начиналась с пустоты. Все шаги идут одним
+    запросом и выполняются, только если подписки ещё не было.
+    Возвращает (изменилось ли что-то, число подписчиков автора).
+    """
+    cur.execute("""
+        WITH inserted AS (
+            INSERT INTO subscriptions (follower_id, following_id)
+            VALUES (%(follower_id)s, %(following_id)s)
+            ON CONFLICT (follower_id, following_id) DO NOTHING
+            RETURNING follower_id, following_id
+        ),
+        counted AS (
+            UPDATE users u SET
+                followers_count = u.followers_count + (u.id = i.following_id)::int,
+                following_count = u.following_count + (u.id = i.follower_id)::int
+            FROM inserted i
+            WHERE u.id IN (i.follower_id, i.following_id)
+            RETURNING u.id, u.followers_count
+        ),
+        backfilled AS (
+            INSERT INTO timelines (user_id, post_id, created_at)
+            SELECT i.follower_id, p.id, p.created_at
+            FROM inserted i
+            JOIN users u ON u.id = i.following_id AND NOT u.fanout_on_read
+            CROSS JOIN LATERAL (
+                SELECT id, created_at FROM posts
+                WHERE user_id = i.following_id AND created_at IS NOT NULL
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(backfill)s
+            ) p
+            ON CONFLICT DO NOTHING
+        )
+        SELECT EXISTS (SELECT 1 FROM inserted), COALESCE(
+            (SELECT followers_count FROM counted WHERE id = %(following_id)s),
+            (SELECT followers_count FROM users WHERE id = %(following_id)s),
+            0
+        )
+    """, {'follower_id': follower_id, 'following_id': following_id, 'backfill': TIMELINE_BACKFILL})
+    return cur.fetchone()
+
+def unsubscribe(cur, follower_id: int, following_id: int) -> tuple:
+    """Отписаться, обновив счётчики и убрав посты автора из ленты подписчика, одним запросом.
+    
+    Возвращает (изменилось ли что-то, число подписчиков автора).
+    """
+    cur.execute("""
+        WITH deleted AS (
+            DELETE FROM subscriptions
+            WHERE follower_id = %(follower_id)s AND following_id = %(following_id)s
+            RETURNING follower_id, following_id
+        ),
+        counted AS (
+            UPDATE users u SET
+                followers_count = u.followers_count - (u.id = d.following_id)::int,
+                following_count = u.following_count - (u.id = d.follower_id)::int
+            FROM deleted d
+            WHERE u.id IN (d.follower_id, d.following_id)
+            RETURNING u.id, u.followers_count
+        ),
+        unlisted AS (
+            DELETE FROM timelines t
+            USING deleted d, posts p
+            WHERE t.user_id = d.follower_id AND t.post_id = p.id AND p.user_id = d.following_id
+        )
+        SELECT EXISTS (SELECT 1 FROM deleted), COALESCE(
+            (SELECT followers_count FROM counted WHERE id = %(following_id)s),
+            (SELECT followers_count FROM users WHERE id = %(following_id)s),
+            0
+        )
+    """, {'follower_id': follower_id, 'following_id': following_id})
+    return cur.fetchone()
+
+def issue_token(user_id: int, username: str) -> str:
+    with timed('jwt'):
+        return jwt.encode({
+            'user_id': user_id,
+            'username': username,
+            'exp': datetime.utcnow() + timedelta(days=30)
+        }, JWT_SECRET, algorithm='HS256')
+
+@rate_limited('register', per_minute=5, burst=5)
+def register(req: Request) -> dict:
+    """Зарегистрировать пользователя одним INSERT: занятость имени и почты
+    проверяют уникальные индексы по lower(), без предварительного SELECT"""
+    username = req.body.get('username')
+    email = req.body.get('email')
+    password = req.body.get('password')
+    
+    if not username or not email or not password:
+        return error(400, 'Missing required fields')
+    
+    if not all(isinstance(value, str) for value in (username, email, password)):
+        return error(400, 'Invalid username or email')
+    
+    # Вход различает имя и почту по "@", поэтому в имени его быть не может
+    if '@' in username or '@' not in email:
+        return error(400, 'Invalid username or email')
+    
+    password_hash = hash_password(password)
+    
+    req.cur.execute(
+        "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) "
+        "ON CONFLICT DO NOTHING "
+        "RETURNING id, username, email, avatar, banner, bio",
+        (username, email, password_hash)
+    )
+    row = req.cur.fetchone()
+    if not row:
+        req.conn.rollback()
+        return error(409, 'User already exists')
+    
+    user = rows_to_dicts(req.cur, [row])[0]
+    req.conn.commit()
+    
+    return respond(201, {'token': issue_token(user['id'], user['username']), 'user': user})
+
+def find_login_user(cur, column: str, value: str):
+    """Строка пользователя для входа по уникальному индексу lower(username) или lower(email)"""
+    cur.execute(
+        f"SELECT id, username, email, password_hash, avatar, banner, bio FROM users WHERE lower({column}) = lower(%s)",
+        (value,)
+    )
+    return cur.fetchone()
+
+def login_key(req: Request) -> str:
+    """Ключ лимита входа по имени или почте без учёта регистра: подбор пароля
+    к одному аккаунту с разных IP упирается в общий bucket"""
+    username = req.body.get('username')
+    return 'n' + (username.lower() if isinstance(username, str) else '')
+
+@rate_limited('login', per_minute=10, burst=10)
+@rate_limited('login_account', per_minute=10, burst=10, key=login_key)
+def login(req: Request) -> dict:
+    username = req.body.get('username')
+    password = req.body.get('password')
+    
+    if not username or not password:
+        return error(400, 'Missing credentials')
+    
+    if not isinstance(username, str) or not isinstance(password, str):
+        return error(400, 'Invalid credentials')
+    
+    # Почта всегда содержит "@", новое имя — никогда: ищем по одному индексу вместо OR
+    row = find_login_user(req.cur, 'email' if '@' in username else 'username', username)
+    if not row and '@' in username:
+        # Имена с "@", зарегистрированные до этого правила, входят по имени
+        row = find_login_user(req.cur, 'username', username)
+    
+    if not row:
+        return error(401, 'Invalid credentials')
+    
+    user = rows_to_dicts(req.cur, [row])[0]
+    password_hash = user.pop('password_hash')
+    password_valid, needs_rehash = check_password(password, password_hash)
+    
+    if not password_valid:
+        return error(401, 'Invalid credentials')
+    
+    if needs_rehash:
+        try:
+            req.cur.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s",
+                (hash_password(password), user['id'])
+            )
+            req.conn.commit()
+            with _hash_stats_lock:
+                hash_stats['rehashed'] += 1
+        except HashPoolSaturated:
+            pass
+    
+    return respond(200, {'token': issue_token(user['id'], user['username']), 'user': user})
+
+@authenticated
+def verify(req: Request) -> dict:
+    profile = get_cached_profile(req.token)
+    if profile:
+        return respond(200, {'user': profile})
+    
+    req.cur.execute("""
+        SELECT id, username, email, avatar, banner, bio, phone,
+            followers_count AS followers, following_count AS following
+        FROM users WHERE id = %s
+    """, (req.user_id,))
+    row = req.cur.fetchone()
+    
+    if not row:
+        return error(404, 'User not found')
+    
+    profile = rows_to_dicts(req.cur, [row])[0]
+    cache_profile(req.token, profile)
+    return respond(200, {'user': profile})
+
+@authenticated
+def change_subscription(req: Request) -> dict:
+    following_id = req.body.get('userId')
+    
+    if not isinstance(following_id, int) or following_id == req.user_id:
+        return error(400, 'Invalid user')
+    
+    try:
+        if req.action == 'subscribe':
+            changed, followers = subscribe(req.cur, req.user_id, following_id)
+        else:
+            changed, followers = unsubscribe(req.cur, req.user_id, following_id)
+    except psycopg2.IntegrityError:
+        req.conn.rollback()
+        return error(404, 'User not found')
+    
+    req.conn.commit()
+    
+    if changed:
+        invalidate_profiles(req.user_id, following_id)
+    
+    return respond(200, {'subscribed': req.action == 'subscribe', 'followers': followers})
+
+USERNAME_MAX_LENGTH = 50
+
+def search_users(req: Request) -> dict:
+    """Поиск пользователей по началу имени (q) без учёта регистра.
+    
+    Условие lower(username) LIKE 'q%' обслуживается триграммным индексом,
+    выдача идёт по имени, курсор — (имя, id) последнего элемента.
+    """
+    prefix = (req.params.get('q') or '').strip().lower()
+    limit = get_page_size(req.params)
+    cursor = req.params.get('cursor')
+    position = decode_cursor(cursor, str) if cursor else None
+    
+    if not prefix or len(prefix) > USERNAME_MAX_LENGTH:
+        return error(400, 'Invalid search query')
+    if limit is None or (cursor and not position):
+        return error(400, 'Invalid cursor or limit')
+    
+    pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    where = 'AND (lower(username), id) > (%s, %s)' if position else ''
+    req.cur.execute(f"""
+        SELECT id, username, avatar, followers_count AS followers, lower(username) AS sort_key
+        FROM users
+        WHERE lower(username) LIKE %s {where}
+        ORDER BY lower(username), id
+        LIMIT %s
+    """, (pattern, *(position or ()), limit + 1))
+    
+    users = rows_to_dicts(req.cur, req.cur.fetchall())
+    has_more = len(users) > limit
+    users = users[:limit]
+    sort_keys = [user.pop('sort_key') for user in users]
+    next_cursor = encode_cursor(sort_keys[-1], users[-1]['id']) if has_more else None
+    
+    return respond(200, {'users': users, 'nextCursor': next_cursor, 'hasMore': has_more})
+
+ROUTES = {
+    ('GET', None): search_users,
+    ('POST', 'register'): register,
+    ('POST', 'login'): login,
+    ('POST', 'verify'): verify,
+    ('POST', 'subscribe'): change_subscription,
+    ('POST', 'unsubscribe'): change_subscription,
+}
+
+PREFLIGHT = preflight_response(ROUTES)
+
+def handler(event: dict, context) -> dict:
+    """API для регистрации и авторизации пользователей"""
+    try:
+        return dispatch(event, context, ROUTES, PREFLIGHT)
+    except HashPoolSaturated:
+        return error(429, 'Too many requests, try again later', {'Retry-After': '1'})
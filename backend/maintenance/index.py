@@ -0,0 +1,265 @@
+import hmac
+import json
+import os
+import psycopg2
+from psycopg2.extras import execute_values
+
+FLUSH_BATCH_SIZE = int(os.environ.get('FLUSH_BATCH_SIZE', '1000'))
+VIEW_DEDUP_WINDOW_HOURS = int(os.environ.get('VIEW_DEDUP_WINDOW_HOURS', '24'))
+VIEW_TREND_WEIGHT = float(os.environ.get('VIEW_TREND_WEIGHT', '0.1'))
+VOTE_PARTITIONS_AHEAD = int(os.environ.get('VOTE_PARTITIONS_AHEAD', '2'))
+VOTE_ARCHIVE_AFTER_DAYS = int(os.environ.get('VOTE_ARCHIVE_AFTER_DAYS', '365'))
+CHANGE_LOG_RETENTION_MINUTES = int(os.environ.get('CHANGE_LOG_RETENTION_MINUTES', '60'))
+
+COUNTER_TABLES = [
+    ('posts', 'post_likes', 'post_id', 'post_counter_shards', 'post_changes'),
+    ('shorts', 'short_likes', 'short_id', 'short_counter_shards', 'short_changes'),
+]
+
+def rollup_counters(cur) -> dict:
+    """Свернуть накопленные шарды счётчиков лайков и приросты рейтинга в posts и shorts"""
+    result = {}
+    for table, _, key, shards, _ in COUNTER_TABLES:
+        cur.execute(f"""
+            WITH drained AS (
+                DELETE FROM {shards} RETURNING {key}, likes, dislikes, trend
+            ), totals AS (
+                SELECT {key} AS id, SUM(likes) AS likes, SUM(dislikes) AS dislikes, trend_sum(trend) AS trend
+                FROM drained
+                GROUP BY {key}
+            )
+            UPDATE {table} t
+            SET likes = t.likes + totals.likes, dislikes = t.dislikes + totals.dislikes,
+                trend_score = trend_add(t.trend_score, totals.trend)
+            FROM totals
+            WHERE t.id = totals.id
+        """)
+        result[table] = cur.rowcount
+    return result
+
+def reconcile_counters(cur) -> dict:
+    """Пересчитать счётчики лайков с нуля по таблицам голосов.
+    
+    Таблица шардов блокируется на время пересчёта: голоса, которые ещё не
+    успели записать дельту, допишут её после коммита и не потеряются.
+    Приросты рейтинга из шардов перед очисткой переносятся в trend_score.
+    Записи с голосами в архивных секциях сохраняют свои счётчики.
+    Исправленные записи попадают в журнал изменений для delta-запросов лент.
+    """
+    result = {}
+    for table, votes, key, shards, changes in COUNTER_TABLES:
+        cur.execute(f"LOCK TABLE {shards} IN EXCLUSIVE MODE")
+        cur.execute("SELECT COALESCE(MAX(archived_below), 0) FROM vote_archive_bounds WHERE table_name = %s", (votes,))
+        archived_below = cur.fetchone()[0]
+        # Голоса архивных записей не пересчитываются, их дельты сворачиваются как есть
+        cur.execute(f"""
+            WITH drained AS (
+                DELETE FROM {shards} RETURNING {key}, likes, dislikes, trend
+            )
+            UPDATE {table} t SET
+                trend_score = trend_add(t.trend_score, d.trend),
+                likes = t.likes + CASE WHEN t.id < %(archived_below)s THEN d.likes ELSE 0 END,
+                dislikes = t.dislikes + CASE WHEN t.id < %(archived_below)s THEN d.dislikes ELSE 0 END
+            FROM (
+                SELECT {key} AS id, SUM(likes) AS likes, SUM(dislikes) AS dislikes, trend_sum(trend) AS trend
+                FROM drained GROUP BY {key}
+            ) d
+            WHERE t.id = d.id
+        """, {'archived_below': archived_below})
+        cur.execute(f"""
+            WITH fixed AS (
+                UPDATE {table} t
+                SET likes = v.likes, dislikes = v.dislikes
+                FROM (
+                    SELECT
+                        t.id,
+                        COUNT(l.{key}) FILTER (WHERE l.is_like) AS likes,
+                        COUNT(l.{key}) FILTER (WHERE NOT l.is_like) AS dislikes
+                    FROM {table} t
+                    LEFT JOIN {votes} l ON l.{key} = t.id
+                    WHERE t.id >= %s
+                    GROUP BY t.id
+                ) v
+                WHERE t.id = v.id AND (t.likes, t.dislikes) IS DISTINCT FROM (v.likes, v.dislikes)
+                RETURNING t.id
+            )
+            INSERT INTO {changes} ({key}) SELECT id FROM fixed
+        """, (archived_below,))
+        result[table] = cur.rowcount
+    return result
+
+def flush_views(cur) -> dict:
+    """Свернуть буфер просмотров клипов в shorts.views.
+    
+    Каждая пачка из FLUSH_BATCH_SIZE клипов применяется одним
+    UPDATE ... FROM (VALUES ...), заодно поднимая trend_score на просмотры
+    с весом VIEW_TREND_WEIGHT. Строки с ключом зрителя хранятся ещё
+    VIEW_DEDUP_WINDOW_HOURS часов, чтобы повторы не засчитывались.
+    Клипы с новыми просмотрами попадают в журнал изменений short_changes.
+    """
+    cur.execute("""
+        WITH batch AS (
+            UPDATE short_view_buffer SET flushed = TRUE WHERE NOT flushed RETURNING short_id
+        )
+        SELECT short_id, COUNT(*) FROM batch GROUP BY short_id ORDER BY short_id
+    """)
+    totals = cur.fetchall()
+    
+    execute_values(cur, f"""
+        UPDATE shorts s SET
+            views = s.views + v.views,
+            trend_score = trend_add(s.trend_score, trend_point(v.views * {VIEW_TREND_WEIGHT}, LOCALTIMESTAMP))
+        FROM (VALUES %s) AS v(id, views)
+        WHERE s.id = v.id
+    """, totals, page_size=FLUSH_BATCH_SIZE)
+    cur.execute("INSERT INTO short_changes (short_id) SELECT unnest(%s::int[])", ([short_id for short_id, _ in totals],))
+    
+    cur.execute("""
+        DELETE FROM short_view_buffer
+        WHERE flushed AND (viewer_key IS NULL OR viewed_at < CURRENT_TIMESTAMP - make_interval(hours => %s))
+    """, (VIEW_DEDUP_WINDOW_HOURS,))
+    
+    return {'shorts': len(totals), 'views': sum(views for _, views in totals), 'purged': cur.rowcount}
+
+def create_partitions(cur) -> dict:
+    """Заранее создать секции таблиц голосов на VOTE_PARTITIONS_AHEAD диапазонов вперёд от последней записи"""
+    result = {}
+    for table, votes, key, _, _ in COUNTER_TABLES:
+        cur.execute(f"""
+            SELECT ensure_vote_partitions(%s, %s, (SELECT COALESCE(MAX(id), 0) FROM {table}) + vote_partition_size() * %s)
+        """, (votes, key, VOTE_PARTITIONS_AHEAD))
+        result[votes] = cur.fetchone()[0]
+    return result
+
+def archive_partitions(cur) -> dict:
+    """Отсоединить секции голосов, все записи которых старше VOTE_ARCHIVE_AFTER_DAYS дней.
+    
+    Отсоединённая секция переходит в таблицу <votes>_archive с прежними
+    голосами и уходит из индексов и очистки основной таблицы. Граница
+    архива записывается в vote_archive_bounds в той же транзакции: записи
+    ниже неё больше не принимают голоса (409), их счётчики остаются как
+    есть, а голос пользователя по-прежнему читается из архива.
+    """
+    result = {}
+    for table, votes, _, _, _ in COUNTER_TABLES:
+        cur.execute(f"""
+            SELECT vote_partition_size(), COALESCE(
+                (SELECT MIN(id) FROM {table} WHERE created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)),
+                (SELECT MAX(id) + 1 FROM {table}),
+                0
+            )
+        """, (VOTE_ARCHIVE_AFTER_DAYS,))
+        size, hot_from = cur.fetchone()
+        
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass AND c.relname ~ '_p[0-9]+$'
+        """, (votes,))
+        buckets = sorted(int(name.rsplit('_p', 1)[1]) for name, in cur.fetchall())
+        cold = [bucket for bucket in buckets if (bucket + 1) * size <= hot_from]
+        if not cold:
+            result[votes] = 0
+            continue
+        
+        cur.execute("""
+            INSERT INTO vote_archive_bounds (table_name, archived_below) VALUES (%s, %s)
+            ON CONFLICT (table_name) DO UPDATE
+            SET archived_below = GREATEST(vote_archive_bounds.archived_below, EXCLUDED.archived_below)
+        """, (votes, (cold[-1] + 1) * size))
+        for bucket in cold:
+            cur.execute(f"ALTER TABLE {votes} DETACH PARTITION {votes}_p{bucket}")
+            cur.execute(f"""
+                ALTER TABLE {votes}_archive ATTACH PARTITION {votes}_p{bucket}
+                FOR VALUES FROM ({bucket * size}) TO ({(bucket + 1) * size})
+            """)
+        result[votes] = len(cold)
+    return result
+
+def prune_changes(cur) -> dict:
+    """Удалить из журналов изменений записи старше CHANGE_LOG_RETENTION_MINUTES минут.
+    
+    Граница очистки сдвигается в change_log_bounds в той же транзакции:
+    delta-запрос с водяным знаком ниже неё получает reset.
+    """
+    result = {}
+    for _, _, key, _, changes in COUNTER_TABLES:
+        cur.execute(f"""
+            WITH pruned AS (
+                DELETE FROM {changes}
+                WHERE updated_at < CURRENT_TIMESTAMP - make_interval(mins => %s)
+                RETURNING txid
+            ), bound AS (
+                INSERT INTO change_log_bounds (table_name, pruned_below)
+                SELECT %s, (MAX(txid)::text::bigint + 1)::text::xid8 FROM pruned HAVING COUNT(*) > 0
+                ON CONFLICT (table_name) DO UPDATE
+                SET pruned_below = GREATEST(change_log_bounds.pruned_below, EXCLUDED.pruned_below)
+            )
+            SELECT COUNT(*) FROM pruned
+        """, (CHANGE_LOG_RETENTION_MINUTES, changes))
+        result[changes] = cur.fetchone()[0]
+    return result
+
+JOBS = {
+    'rollup-counters': rollup_counters,
+    'reconcile-counters': reconcile_counters,
+    'flush-views': flush_views,
+    'create-partitions': create_partitions,
+    'archive-partitions': archive_partitions,
+    'prune-changes': prune_changes,
+}
+
+def handler(event: dict, context) -> dict:
+    """Фоновые задачи обслуживания БД, запускаются по таймеру или вручную с токеном"""
+    if 'messages' in event:
+        # Таймер-триггер: имя задачи приходит в payload сообщения
+        actions = [m.get('details', {}).get('payload') for m in event['messages']]
+    else:
+        if event.get('httpMethod', 'GET') != 'POST':
+            return {
+                'statusCode': 405,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Method not allowed'}),
+                'isBase64Encoded': False
+            }
+        
+        expected_token = os.environ.get('MAINTENANCE_TOKEN', '')
+        token = event.get('headers', {}).get('X-Maintenance-Token', '')
+        if not expected_token or not hmac.compare_digest(token.encode('utf-8'), expected_token.encode('utf-8')):
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Unauthorized'}),
+                'isBase64Encoded': False
+            }
+        
+        body = json.loads(event.get('body', '{}'))
+        actions = [body.get('action')]
+    
+    if not actions or any(action not in JOBS for action in actions):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Invalid action'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    cur = conn.cursor()
+    
+    try:
+        results = {}
+        for action in actions:
+            results[action] = JOBS[action](cur)
+            conn.commit()
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'results': results}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
@@ -1,201 +1,1385 @@
+import base64
+import collections
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
 import json
+import math
 import os
-import psycopg2
-import jwt
+import random
+import re
+import threading
+import time
+from datetime import date, datetime
 
-def get_user_from_token(auth_header: str, jwt_secret: str):
-    """Извлечь user_id из JWT токена"""
-    if not auth_header or not auth_header.startswith('Bearer '):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Общий каркас функций. Блок до "Конец общего каркаса" одинаковый в auth, posts
+# и shorts: каждая функция деплоится отдельной папкой, поэтому код не выносится
+# в общий пакет. Расхождение копий ловит bench/check_shared.py. maintenance
+# запускается таймером и каркасом не пользуется.
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к его атрибуту.
+    
+    psycopg2 и jwt не нужны preflight-запросам и ответам из кэша в памяти,
+    поэтому холодный старт контейнера их не ждёт.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+    
+    def __getattr__(self, attr: str):
+        return getattr(__import__(self._name), attr)
+
+psycopg2 = LazyModule('psycopg2')
+jwt = LazyModule('jwt')
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '2'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_pool = []
+_pool_lock = threading.Lock()
+pool_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'discarded': 0}
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def acquire_connection():
+    """Взять соединение из пула тёплого контейнера или открыть новое"""
+    while True:
+        with _pool_lock:
+            if not _pool:
+                break
+            conn, released_at = _pool.pop()
+        
+        if conn.closed:
+            pool_stats['stale'] += 1
+            continue
+        
+        if time.monotonic() - released_at > DB_POOL_PING_AFTER:
+            try:
+                with conn.cursor() as ping:
+                    ping.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                pool_stats['stale'] += 1
+                _close_quietly(conn)
+                continue
+        
+        pool_stats['hits'] += 1
+        return conn
+    
+    pool_stats['misses'] += 1
+    return psycopg2.connect(
+        os.environ.get('DATABASE_URL'),
+        connect_timeout=5,
+        keepalives=1,
+        keepalives_idle=30
+    )
+
+def release_connection(conn):
+    """Вернуть соединение в пул, закрыв лишние и сломанные"""
+    if conn.closed:
+        return
+    
+    try:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _close_quietly(conn)
+        return
+    
+    with _pool_lock:
+        if len(_pool) < DB_POOL_SIZE:
+            _pool.append((conn, time.monotonic()))
+            return
+    
+    pool_stats['discarded'] += 1
+    _close_quietly(conn)
+
+JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback-secret')
+
+# Замеры запросов: строка JSON-лога на каждый вызов и, по желанию, Server-Timing
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_cold_start = True
+
+# Накопительные счётчики тёплого контейнера, которые попадают в строку лога каждого вызова
+trace_stats = {'pool': pool_stats}
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_VALUES_RE = re.compile(r'\([?, ]+\)(?:\s*,\s*\([?, ]+\))+')
+
+@functools.lru_cache(maxsize=256)
+def normalize_sql(query) -> str:
+    """Текст запроса без переносов и литералов, чтобы одинаковые запросы группировались"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    text = _SQL_LITERAL_RE.sub('?', ' '.join(str(query).split()))
+    return _SQL_VALUES_RE.sub('(?), ...', text)[:300]
+
+class Trace:
+    """Замеры одного вызова: время по этапам (db_connect, db, jwt, bcrypt, serialize) и запросы к БД"""
+    
+    def __init__(self, action: str, cold: bool):
+        self.action = action
+        self.cold = cold
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = []
+        self.total = 0.0
+    
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+    
+    def finish(self, context, response):
+        self.total = time.perf_counter() - self.started
+        if not TRACE_LOG:
+            return
+        print(json_dumps({
+            'type': 'request',
+            'function': getattr(context, 'function_name', None),
+            'requestId': getattr(context, 'request_id', None),
+            'action': self.action,
+            'status': response['statusCode'] if response else None,
+            'cold': self.cold,
+            'totalMs': round(self.total * 1000, 3),
+            'spans': {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()},
+            'queryCount': len(self.queries),
+            'queries': [{'sql': normalize_sql(query), 'ms': round(seconds * 1000, 3)} for query, seconds in self.queries],
+            'stats': {name: dict(values) for name, values in trace_stats.items()},
+        }), flush=True)
+    
+    def annotate(self, response: dict) -> dict:
+        """Добавить к ответу заголовок Server-Timing, если он включён"""
+        if not SERVER_TIMING:
+            return response
+        metrics = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.spans.items()]
+        metrics.append(f'total;dur={self.total * 1000:.3f}')
+        if self.cold:
+            metrics.append('cold')
+        headers = {**response['headers'], 'Server-Timing': ', '.join(metrics), 'Timing-Allow-Origin': '*'}
+        return {**response, 'headers': headers}
+
+@contextlib.contextmanager
+def timed(name: str):
+    """Засчитать время блока в этап name текущего вызова"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - started)
+
+@functools.cache
+def timed_cursor():
+    """Класс курсора, который записывает каждый запрос и его время в трассу текущего вызова.
+    
+    Создаётся при первом соединении: базовый класс тянет импорт psycopg2.
+    """
+    class TimedCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                trace = _current_trace.get()
+                if trace is not None:
+                    elapsed = time.perf_counter() - started
+                    trace.add('db', elapsed)
+                    trace.queries.append((query, elapsed))
+    return TimedCursor
+
+# Общие заголовки JSON-ответов: один объект на все ответы, не изменяется
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+if orjson is not None:
+    def json_dumps(data) -> str:
+        """Сериализовать тело ответа через orjson"""
+        with timed('serialize'):
+            return orjson.dumps(data, default=_json_default).decode('utf-8')
+else:
+    _json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+    
+    def json_dumps(data) -> str:
+        """Сериализовать тело ответа заранее созданным JSONEncoder"""
+        with timed('serialize'):
+            return _json_encoder.encode(data)
+
+def respond(status: int, payload=None, headers: dict = None) -> dict:
+    """Собрать ответ функции с JSON-телом"""
+    return {
+        'statusCode': status,
+        'headers': JSON_HEADERS if headers is None else {**JSON_HEADERS, **headers},
+        'body': '' if payload is None else json_dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def error(status: int, message: str, headers: dict = None) -> dict:
+    return respond(status, {'error': message}, headers)
+
+def rows_to_dicts(cur, rows: list) -> list:
+    """Превратить строки в словари по именам колонок из cur.description.
+    
+    Колонка с именем вида "author.id" попадает во вложенный объект author.
+    """
+    names = [column.name for column in cur.description]
+    if not any('.' in name for name in names):
+        return [dict(zip(names, row)) for row in rows]
+    
+    columns = [name.split('.', 1) for name in names]
+    items = []
+    for row in rows:
+        item = {}
+        for column, value in zip(columns, row):
+            if len(column) == 2:
+                item.setdefault(column[0], {})[column[1]] = value
+            else:
+                item[column[0]] = value
+        items.append(item)
+    return items
+
+class Request:
+    """Разобранный запрос к функции с ленивым соединением из пула"""
+    
+    def __init__(self, event: dict):
+        self.event = event
+        self.method = event.get('httpMethod', 'GET')
+        self.headers = event.get('headers') or {}
+        self.params = event.get('queryStringParameters') or {}
+        self.body = json.loads(event.get('body') or '{}') if self.method == 'POST' else {}
+        if not isinstance(self.body, dict):
+            raise ValueError('Request body must be a JSON object')
+        self.action = self.body.get('action')
+        self.token = None
+        self.user_id = None
+        self._conn = None
+        self._cur = None
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            with timed('db_connect'):
+                self._conn = acquire_connection()
+        return self._conn
+    
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = self.conn.cursor(cursor_factory=timed_cursor())
+        return self._cur
+    
+    def close(self):
+        if self._cur is not None:
+            self._cur.close()
+        if self._conn is not None:
+            release_connection(self._conn)
+
+def decode_token(req: Request):
+    """Проверить JWT из X-Authorization: (payload, None) или (None, ответ 401)"""
+    auth_header = req.headers.get('X-Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None, error(401, 'No token provided')
+    
+    try:
+        with timed('jwt'):
+            payload = jwt.decode(auth_header[len('Bearer '):], JWT_SECRET, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, error(401, 'Token expired')
+    except jwt.InvalidTokenError:
+        return None, error(401, 'Invalid token')
+    
+    if not payload.get('user_id'):
+        return None, error(401, 'Invalid token')
+    return payload, None
+
+def authenticated(route):
+    """Пустить в обработчик только запросы с валидным JWT (req.token, req.user_id)"""
+    @functools.wraps(route)
+    def wrapper(req: Request) -> dict:
+        payload, failure = decode_token(req)
+        if failure:
+            return failure
+        req.token = payload
+        req.user_id = payload['user_id']
+        return route(req)
+    return wrapper
+
+RATE_LIMIT_SCALE = float(os.environ.get('RATE_LIMIT_SCALE', '1'))
+RATE_LIMIT_LOCAL_KEYS = int(os.environ.get('RATE_LIMIT_LOCAL_KEYS', '10000'))
+
+class LocalRateStore:
+    """Token bucket в памяти тёплого контейнера: ключ -> [токены, время пополнения]"""
+    
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = {}
+    
+    def take(self, key: str, rate: float, burst: float, count: int = 1) -> tuple:
+        """Списать до count токенов: (сколько списано, секунд до следующего токена, если списаны не все)"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.pop(next(iter(self._buckets)))
+            bucket = self._buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        granted = min(count, int(tokens))
+        bucket[0], bucket[1] = tokens - granted, now
+        return granted, 0.0 if granted == count else (1 - bucket[0]) / rate
+
+class RedisRateStore:
+    """Общий для всех контейнеров token bucket в Redis.
+    
+    Пополнение и списание делает один Lua-скрипт, поэтому параллельные
+    контейнеры не теряют списания. Ошибки Redis пропускают запрос:
+    недоступный лимитер не должен ронять запись.
+    """
+    
+    SCRIPT = """
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local rate, burst, now, count = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + math.max(0, now - (tonumber(bucket[2]) or now)) * rate)
+        local granted = math.min(count, math.floor(tokens))
+        tokens = tokens - granted
+        local wait = 0
+        if granted < count then wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+        return {granted, tostring(wait)}
+    """
+    
+    def __init__(self, url: str, namespace: str):
+        import redis
+        client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self._take = client.register_script(self.SCRIPT)
+        self._errors = (redis.RedisError,)
+        self.namespace = namespace
+    
+    def take(self, key: str, rate: float, burst: float, count: int = 1) -> tuple:
+        try:
+            granted, wait = self._take(keys=[f'{self.namespace}:{key}'], args=[rate, burst, time.time(), count])
+            return int(granted), float(wait)
+        except self._errors:
+            return count, 0.0
+
+rate_stores = [LocalRateStore(RATE_LIMIT_LOCAL_KEYS)]
+if os.environ.get('RATE_LIMIT_REDIS_URL'):
+    rate_stores.append(RedisRateStore(os.environ['RATE_LIMIT_REDIS_URL'], 'rate'))
+
+# bucket -> (токенов в секунду, ёмкость, ключ); заполняет rate_limited
+rate_limits = {}
+
+def client_ip(req: Request) -> str:
+    """Адрес клиента: sourceIp шлюза, иначе последний адрес X-Forwarded-For.
+    
+    Первые адреса X-Forwarded-For присылает сам клиент и может подменить,
+    последний дописывает ближайший к функции прокси.
+    """
+    source_ip = ((req.event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    if source_ip:
+        return source_ip
+    forwarded = req.headers.get('X-Forwarded-For') or req.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.rsplit(',', 1)[-1].strip()
+    return 'unknown'
+
+def take_rate(req: Request, bucket: str, count: int = 1) -> tuple:
+    """Списать до count токенов bucket'а, объявленного через rate_limited:
+    (сколько действий разрешено, секунд до следующего токена)"""
+    rate, capacity, key = rate_limits[bucket]
+    if rate <= 0:
+        return count, 0.0
+    if key:
+        identity = key(req)
+    else:
+        identity = f'u{req.user_id}' if req.user_id else f'ip{client_ip(req)}'
+    max_wait = 0.0
+    for store in rate_stores:
+        count, wait = store.take(f'{bucket}:{identity}', rate, capacity, count)
+        max_wait = max(max_wait, wait)
+        if not count:
+            break
+    return count, max_wait
+
+def rate_limited(bucket: str, per_minute: float, burst: int, key=None):
+    """Ограничить частоту вызовов обработчика token bucket'ом на пользователя
+    (или на IP для анонимных запросов): при исчерпании — 429 с Retry-After.
+    
+    key(req) задаёт свой ключ bucket'а, например имя при входе. Сначала
+    проверяется локальный bucket, до общего хранилища доходят только
+    прошедшие его запросы. RATE_LIMIT_SCALE умножает лимиты, 0 отключает их.
+    Пакетные обработчики списывают токены того же bucket'а по числу
+    действий через take_rate.
+    """
+    rate_limits[bucket] = (per_minute * RATE_LIMIT_SCALE / 60, burst * RATE_LIMIT_SCALE, key)
+    
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(req: Request) -> dict:
+            allowed, wait = take_rate(req, bucket)
+            if not allowed:
+                return error(429, 'Too many requests', {'Retry-After': str(math.ceil(wait))})
+            return route(req)
+        return wrapper
+    return decorator
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+def accepted_encoding(req: Request):
+    """Лучшая из поддерживаемых клиентом кодировок по Accept-Encoding: 'br', 'gzip' или None"""
+    header = req.headers.get('Accept-Encoding') or req.headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.lower().split(','):
+        name, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(req: Request, response: dict) -> dict:
+    """Сжать тело ответа, если клиент это принимает и тело не меньше COMPRESS_MIN_BYTES"""
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded') or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = accepted_encoding(req)
+    if encoding is None:
+        return response
+    
+    with timed('compress'):
+        raw = body.encode('utf-8')
+        compressed = brotli.compress(raw, quality=5) if encoding == 'br' else gzip.compress(raw, compresslevel=6)
+    return {
+        **response,
+        'headers': {**response['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def preflight_response(routes: dict) -> dict:
+    """Ответ на OPTIONS для набора маршрутов: собирается один раз при загрузке модуля и не изменяется"""
+    methods = sorted({route_method for route_method, _ in routes})
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def dispatch(event: dict, context, routes: dict, preflight: dict) -> dict:
+    """Единая точка входа: готовый preflight, выбор обработчика по (метод, action), замеры, возврат соединения"""
+    global _cold_start
+    method = event.get('httpMethod', 'GET')
+    if method == 'OPTIONS':
+        return preflight
+    
+    if method not in {route_method for route_method, _ in routes}:
+        return error(405, 'Method not allowed')
+    
+    try:
+        req = Request(event)
+    except ValueError:
+        return error(400, 'Invalid JSON')
+    
+    route = routes.get((method, req.action))
+    if route is None:
+        return error(400, 'Invalid action')
+    
+    trace = Trace(req.action or route.__name__, _cold_start)
+    _cold_start = False
+    token = _current_trace.set(trace)
+    response = None
+    try:
+        response = compress_response(req, route(req))
+    finally:
+        req.close()
+        _current_trace.reset(token)
+        trace.finish(context, response)
+    return trace.annotate(response)
+
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', '50'))
+FEED_MAX_PAGE_SIZE = int(os.environ.get('FEED_MAX_PAGE_SIZE', '100'))
+
+def encode_cursor(sort_key, item_id) -> str:
+    """Упаковать позицию в выдаче (ключ сортировки, id) в непрозрачный курсор"""
+    raw = f'{sort_key.isoformat() if isinstance(sort_key, datetime) else sort_key}|{item_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, parse_key=datetime.fromisoformat):
+    """Распаковать курсор в (ключ сортировки, id), None если курсор испорчен"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_key, item_id = raw.rsplit('|', 1)
+        return parse_key(sort_key), int(item_id)
+    except (ValueError, UnicodeDecodeError):
         return None
-    token = auth_header.replace('Bearer ', '')
+
+def get_page_size(params: dict):
+    """Размер страницы из параметра limit, None если он некорректен"""
     try:
-        payload = jwt.decode(token, jwt_secret, algorithms=['HS256'])
-        return payload.get('user_id')
-    except:
+        limit = int(params.get('limit') or FEED_PAGE_SIZE)
+    except ValueError:
         return None
+    return min(max(limit, 1), FEED_MAX_PAGE_SIZE)
 
-def handler(event: dict, context) -> dict:
-    """API для работы с клипами и шортсами"""
-    method = event.get('httpMethod', 'GET')
+# Конец общего каркаса
+
+COUNTER_SHARDS = int(os.environ.get('COUNTER_SHARDS', '8'))
+
+def apply_votes(cur, user_id: int, votes: dict) -> dict:
+    """Записать голоса {short_id: isLike} одним запросом и применить к счётчикам только разницу.
     
-    if method == 'OPTIONS':
+    Дельты пишутся в случайный шард short_counter_shards, чтобы голоса за вирусный
+    клип не выстраивались в очередь на одной строке; шарды периодически
+    сворачиваются в shorts функцией maintenance. isLike = None снимает голос.
+    Рейтинг растёт только от первого лайка пользователя: снятие и повторный
+    лайк его не накручивают.
+    Возвращает актуальные {short_id: (likes, dislikes)} без отдельного SELECT,
+    несуществующие и архивные клипы в ответ не попадают, архивные отличает archived_shorts.
+    """
+    cur.execute("""
+        WITH input AS (
+            SELECT v.item_id, v.is_like
+            FROM unnest(%(item_ids)s::int[], %(is_likes)s::boolean[]) AS v(item_id, is_like)
+            WHERE EXISTS (SELECT 1 FROM shorts WHERE id = v.item_id)
+                -- голоса за старые записи ушли в архивные секции, такие записи закрыты для голосования
+                AND v.item_id >= (SELECT COALESCE(MAX(archived_below), 0) FROM vote_archive_bounds WHERE table_name = 'short_likes')
+        ), current AS (
+            SELECT l.short_id AS item_id, l.is_like, l.trended
+            FROM short_likes l JOIN input i ON l.short_id = i.item_id
+            WHERE l.user_id = %(user_id)s
+        ), removed AS (
+            -- Снятый голос остаётся строкой с is_like = NULL: флаг trended должен его пережить
+            UPDATE short_likes l SET is_like = NULL FROM input i
+            WHERE i.is_like IS NULL AND l.user_id = %(user_id)s AND l.short_id = i.item_id AND l.is_like IS NOT NULL
+            RETURNING l.short_id AS item_id, NULL::boolean AS new_like
+        ), upserted AS (
+            INSERT INTO short_likes (user_id, short_id, is_like, trended)
+            SELECT %(user_id)s, item_id, is_like, is_like FROM input WHERE is_like IS NOT NULL
+            ON CONFLICT (user_id, short_id) DO UPDATE SET
+                is_like = EXCLUDED.is_like,
+                trended = short_likes.trended OR EXCLUDED.trended
+            WHERE short_likes.is_like IS DISTINCT FROM EXCLUDED.is_like
+            RETURNING short_id AS item_id, is_like AS new_like
+        ), delta AS (
+            -- Прежний голос берётся из снимка до изменения: все подзапросы WITH видят одни данные
+            SELECT
+                changes.item_id,
+                (new_like IS TRUE)::int - (c.is_like IS TRUE)::int AS likes,
+                (new_like IS FALSE)::int - (c.is_like IS FALSE)::int AS dislikes,
+                new_like IS TRUE AND c.trended IS NOT TRUE AS first_like
+            FROM (SELECT * FROM removed UNION ALL SELECT * FROM upserted) changes
+            LEFT JOIN current c ON c.item_id = changes.item_id
+        ), shard AS (
+            INSERT INTO short_counter_shards (short_id, shard, likes, dislikes, trend)
+            SELECT item_id, %(shard)s, likes, dislikes,
+                   CASE WHEN first_like THEN trend_point(1, LOCALTIMESTAMP) END
+            FROM delta
+            WHERE likes <> 0 OR dislikes <> 0
+            ON CONFLICT (short_id, shard) DO UPDATE SET
+                likes = short_counter_shards.likes + EXCLUDED.likes,
+                dislikes = short_counter_shards.dislikes + EXCLUDED.dislikes,
+                trend = trend_add(short_counter_shards.trend, EXCLUDED.trend)
+        ), logged AS (
+            INSERT INTO short_changes (short_id)
+            SELECT item_id FROM delta WHERE likes <> 0 OR dislikes <> 0
+        )
+        SELECT
+            t.id,
+            t.likes + COALESCE(c.likes, 0) + COALESCE(d.likes, 0),
+            t.dislikes + COALESCE(c.dislikes, 0) + COALESCE(d.dislikes, 0)
+        FROM input i
+        JOIN shorts t ON t.id = i.item_id
+        LEFT JOIN delta d ON d.item_id = t.id
+        LEFT JOIN LATERAL (
+            SELECT SUM(likes) AS likes, SUM(dislikes) AS dislikes
+            FROM short_counter_shards WHERE short_id = t.id
+        ) c ON TRUE
+    """, {
+        'user_id': user_id,
+        'item_ids': list(votes),
+        'is_likes': list(votes.values()),
+        'shard': random.randrange(COUNTER_SHARDS)
+    })
+    return {item_id: (likes, dislikes) for item_id, likes, dislikes in cur.fetchall()}
+
+def is_valid_vote(item_id, is_like) -> bool:
+    """Голос из запроса: id — целое число (не bool), isLike — true, false или null"""
+    return isinstance(item_id, int) and not isinstance(item_id, bool) and (is_like is None or isinstance(is_like, bool))
+
+def archived_shorts(cur, item_ids) -> set:
+    """Записи из item_ids, голоса за которые ушли в архив: голосовать за них больше нельзя"""
+    cur.execute("""
+        SELECT id FROM shorts
+        WHERE id = ANY(%s) AND id < (SELECT COALESCE(MAX(archived_below), 0) FROM vote_archive_bounds WHERE table_name = 'short_likes')
+    """, (list(item_ids),))
+    return {item_id for item_id, in cur.fetchall()}
+
+VIEW_DEDUP = os.environ.get('VIEW_DEDUP', 'off')
+VIEW_BATCH_MAX = int(os.environ.get('VIEW_BATCH_MAX', '100'))
+
+def get_viewer_key(user_id: int, session_id):
+    """Ключ дедупликации просмотров согласно VIEW_DEDUP: off, user или session"""
+    if VIEW_DEDUP == 'user':
+        return f'u:{user_id}'
+    if VIEW_DEDUP == 'session':
+        return f'u:{user_id}:{session_id or ""}'
+    return None
+
+def buffer_views(cur, short_ids: list, viewer_key) -> list:
+    """Записать просмотры в нежурналируемый буфер одним INSERT.
+    
+    В shorts.views они попадают пачкой при flush-views в maintenance. С ключом
+    зрителя повторный просмотр того же клипа в окне дедупликации не считается.
+    Возвращает id клипов принятых просмотров.
+    """
+    cur.execute("""
+        INSERT INTO short_view_buffer (short_id, viewer_key)
+        SELECT unnest(%s::int[]), %s
+        ON CONFLICT (short_id, viewer_key) WHERE viewer_key IS NOT NULL DO NOTHING
+        RETURNING short_id
+    """, (short_ids, viewer_key))
+    return [short_id for short_id, in cur.fetchall()]
+
+FEED_CACHE_TTL = float(os.environ.get('FEED_CACHE_TTL', '5'))
+FEED_CACHE_LOCAL_TTL = float(os.environ.get('FEED_CACHE_LOCAL_TTL', '1'))
+FEED_CACHE_MAX_AGE = int(os.environ.get('FEED_CACHE_MAX_AGE', '0'))
+
+class LocalFeedCache:
+    """Кэш сериализованных страниц ленты в памяти тёплого контейнера"""
+    
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+    
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def set(self, key: str, value: tuple):
+        if len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+    
+    def invalidate(self):
+        self._entries.clear()
+
+class RedisFeedCache:
+    """Общий для всех контейнеров кэш страниц ленты в Redis.
+    
+    Сброс — это инкремент версии, входящей в ключи: старые страницы
+    становятся недостижимы и истекают сами. Ошибки Redis считаются промахом.
+    """
+    
+    def __init__(self, url: str, namespace: str, ttl: float):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self._errors = (redis.RedisError,)
+        self.namespace = namespace
+        self.ttl = ttl
+    
+    def _versioned(self, key: str) -> str:
+        version = self._redis.get(f'{self.namespace}:version') or b'0'
+        return f'{self.namespace}:{version.decode()}:{key}'
+    
+    def get(self, key: str):
+        try:
+            raw = self._redis.get(self._versioned(key))
+        except self._errors:
+            return None
+        if raw is None:
+            return None
+        etag, body = raw.decode('utf-8').split(' ', 1)
+        return etag, body
+    
+    def set(self, key: str, value: tuple):
+        try:
+            self._redis.set(self._versioned(key), ' '.join(value).encode('utf-8'), px=int(self.ttl * 1000))
+        except self._errors:
+            pass
+    
+    def invalidate(self):
+        try:
+            self._redis.incr(f'{self.namespace}:version')
+        except self._errors:
+            pass
+
+feed_caches = [LocalFeedCache(FEED_CACHE_LOCAL_TTL)]
+if os.environ.get('FEED_CACHE_REDIS_URL'):
+    feed_caches.append(RedisFeedCache(os.environ['FEED_CACHE_REDIS_URL'], 'feed:shorts', FEED_CACHE_TTL))
+
+def get_feed_cache_key(params: dict):
+    """Ключ кэша для страницы ленты клипов, None если запрос не кэшируется"""
+    if params.get('votes') == 'mine':
+        return None
+    return 'shorts|{}|{}|{}|{}|{}|{}'.format(params.get('limit', ''), params.get('cursor', ''), params.get('since', ''), params.get('authors', ''), params.get('sort', ''), params.get('fields', ''))
+
+def cache_get(key: str):
+    """Найти страницу в кэшах от ближнего к дальнему, подогрев ближние"""
+    for i, cache in enumerate(feed_caches):
+        entry = cache.get(key)
+        if entry:
+            for nearer in feed_caches[:i]:
+                nearer.set(key, entry)
+            return entry
+    return None
+
+def cache_set(key: str, entry: tuple):
+    for cache in feed_caches:
+        cache.set(key, entry)
+
+def invalidate_feed_cache():
+    """Сбросить кэш ленты после create и like"""
+    for cache in feed_caches:
+        cache.invalidate()
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.blake2b(body.encode('utf-8'), digest_size=8).hexdigest() + '"'
+
+def feed_response(req: Request, etag: str, body: str) -> dict:
+    """Ответ со страницей ленты или 304, если у клиента уже эта версия"""
+    if_none_match = req.headers.get('If-None-Match') or req.headers.get('if-none-match') or ''
+    headers = {**JSON_HEADERS, 'ETag': etag, 'Cache-Control': f'public, max-age={FEED_CACHE_MAX_AGE}'}
+    
+    if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
         return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-            },
+            'statusCode': 304,
+            'headers': headers,
             'body': '',
             'isBase64Encoded': False
         }
     
-    db_url = os.environ.get('DATABASE_URL')
-    jwt_secret = os.environ.get('JWT_SECRET', 'fallback-secret')
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+FEED_SNAPSHOT_TTL = float(os.environ.get('FEED_SNAPSHOT_TTL', '15'))
+FEED_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('FEED_SNAPSHOT_CHECK_INTERVAL', '1'))
+
+# Первые страницы анонимной ленты с параметрами, с которыми их запрашивает SPA
+FEED_SNAPSHOTS = {
+    'shorts:latest': {'authors': 'map'},
+    'shorts:trending': {'authors': 'map', 'sort': 'trending'},
+}
+
+_snapshots = {}
+
+def get_snapshot_name(params: dict):
+    for name, snapshot_params in FEED_SNAPSHOTS.items():
+        if params == snapshot_params:
+            return name
+    return None
+
+def make_snapshot(etag: str, body: bytes, body_gzip: bytes, body_br) -> dict:
+    """Снимок в памяти: тела сразу в base64, чтобы ответ не делал никакой работы"""
+    return {
+        'etag': etag,
+        'identity': body.decode('utf-8'),
+        'gzip': base64.b64encode(body_gzip).decode('ascii'),
+        'br': base64.b64encode(body_br).decode('ascii') if body_br is not None else None,
+    }
+
+def load_snapshot(req: Request, name: str):
+    """Актуальный снимок ленты или None.
+    
+    Контейнер перечитывает таблицу не чаще раза в FEED_SNAPSHOT_CHECK_INTERVAL
+    секунд, снимки старше FEED_SNAPSHOT_TTL считаются устаревшими.
+    """
+    now = time.monotonic()
+    entry = _snapshots.get(name)
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    req.cur.execute("""
+        SELECT etag, body, body_gzip, body_br FROM feed_snapshots
+        WHERE name = %s AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (name, FEED_SNAPSHOT_TTL))
+    row = req.cur.fetchone()
+    snapshot = make_snapshot(row[0], bytes(row[1]), bytes(row[2]), row[3] and bytes(row[3])) if row else None
+    _snapshots[name] = (now + FEED_SNAPSHOT_CHECK_INTERVAL, snapshot)
+    return snapshot
+
+def store_snapshot(req: Request, name: str, etag: str, body: str) -> dict:
+    """Сжать отрисованную страницу ленты и сохранить её снимком для всех контейнеров"""
+    raw = body.encode('utf-8')
+    with timed('compress'):
+        body_gzip = gzip.compress(raw, compresslevel=9)
+        body_br = brotli.compress(raw, quality=9) if brotli is not None else None
+    
+    req.cur.execute("""
+        INSERT INTO feed_snapshots (name, etag, body, body_gzip, body_br)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET
+            etag = EXCLUDED.etag, body = EXCLUDED.body, body_gzip = EXCLUDED.body_gzip,
+            body_br = EXCLUDED.body_br, created_at = CURRENT_TIMESTAMP
+    """, (name, etag, raw, body_gzip, body_br))
+    req.conn.commit()
+    
+    snapshot = make_snapshot(etag, raw, body_gzip, body_br)
+    _snapshots[name] = (time.monotonic() + FEED_SNAPSHOT_CHECK_INTERVAL, snapshot)
+    return snapshot
+
+def drop_snapshots(cur):
+    """Удалить снимки лент в текущей транзакции вместе с новой записью.
+    
+    Голоса снимки не сбрасывают: счётчики в них отстают не больше чем на
+    FEED_SNAPSHOT_TTL, свежие значения клиент получает через delta= и realtime.
+    """
+    cur.execute("DELETE FROM feed_snapshots WHERE name = ANY(%s)", (list(FEED_SNAPSHOTS),))
+    _snapshots.clear()
+
+def snapshot_response(req: Request, snapshot: dict) -> dict:
+    """Отдать снимок в лучшей кодировке из Accept-Encoding или 304"""
+    encoding = accepted_encoding(req)
+    if encoding == 'br' and snapshot['br'] is None:
+        encoding = 'gzip'
+    
+    response = feed_response(req, snapshot['etag'], snapshot[encoding] if encoding else snapshot['identity'])
+    response['headers'] = {**response['headers'], 'Vary': 'Accept-Encoding'}
+    if encoding and response['statusCode'] == 200:
+        response['headers']['Content-Encoding'] = encoding
+        response['isBase64Encoded'] = True
+    return response
+
+AUTHOR_CACHE_TTL = float(os.environ.get('AUTHOR_CACHE_TTL', '60'))
+AUTHOR_CACHE_SIZE = int(os.environ.get('AUTHOR_CACHE_SIZE', '4096'))
+
+_author_cache = {}
+
+def get_authors(cur, user_ids) -> dict:
+    """Краткие профили авторов {id: {id, username, avatar}}.
+    
+    Профили живут в памяти тёплого контейнера AUTHOR_CACHE_TTL секунд,
+    промахи добираются одним запросом WHERE id = ANY.
+    """
+    now = time.monotonic()
+    authors, missing = {}, []
+    for user_id in set(user_ids):
+        entry = _author_cache.get(user_id)
+        if entry and entry[0] > now:
+            authors[user_id] = entry[1]
+        else:
+            missing.append(user_id)
+    
+    if missing:
+        cur.execute("SELECT id, username, avatar FROM users WHERE id = ANY(%s)", (missing,))
+        for author in rows_to_dicts(cur, cur.fetchall()):
+            if len(_author_cache) >= AUTHOR_CACHE_SIZE:
+                _author_cache.pop(next(iter(_author_cache)))
+            _author_cache[author['id']] = (now + AUTHOR_CACHE_TTL, author)
+            authors[author['id']] = author
+    return authors
+
+def attach_authors(cur, items: list, as_map: bool):
+    """Подставить авторов в элементы ленты вместо authorId.
+    
+    С as_map элементы сохраняют authorId, а профили возвращаются одним
+    словарём по id, чтобы автор не повторялся в каждом элементе.
+    """
+    authors = get_authors(cur, [item['authorId'] for item in items])
+    if as_map:
+        return {str(user_id): author for user_id, author in authors.items()}
+    for item in items:
+        item['author'] = authors.get(item.pop('authorId'))
+    return None
+
+def attach_votes(cur, items: list, user_id: int):
+    """Проставить элементам myVote пользователя: true — лайк, false — дизлайк, без поля — нет голоса.
+    
+    Голоса всей страницы читаются одним запросом по покрывающему индексу (user_id, short_id),
+    голоса старых клипов — из архивных секций short_likes_archive.
+    """
+    if not items:
+        return
+    cur.execute("""
+        SELECT short_id, is_like FROM short_likes WHERE user_id = %(user_id)s AND short_id = ANY(%(ids)s) AND is_like IS NOT NULL
+        UNION ALL
+        SELECT short_id, is_like FROM short_likes_archive WHERE user_id = %(user_id)s AND short_id = ANY(%(ids)s) AND is_like IS NOT NULL
+    """, {'user_id': user_id, 'ids': [item['id'] for item in items]})
+    votes = dict(cur.fetchall())
+    for item in items:
+        if item['id'] in votes:
+            item['myVote'] = votes[item['id']]
+
+def get_voter(req: Request):
+    """Для votes=mine: (id пользователя, None), без этого параметра (None, None), при плохом токене (None, ответ 401)"""
+    if req.params.get('votes') != 'mine':
+        return None, None
+    payload, failure = decode_token(req)
+    if failure:
+        return None, failure
+    return payload['user_id'], None
+
+# Поля элемента ленты для fields= и выражения, которыми они выбираются
+SHORT_FIELDS = {
+    'id': 's.id',
+    'title': 's.title',
+    'videoUrl': 's.video_url',
+    'thumbnailUrl': 's.thumbnail_url',
+    'duration': 's.duration',
+    'likes': 's.likes + COALESCE(shards.likes, 0)',
+    'dislikes': 's.dislikes + COALESCE(shards.dislikes, 0)',
+    'views': 's.views',
+    'timestamp': 's.created_at',
+    'authorId': 's.user_id',
+}
+
+def get_fields(params: dict):
+    """Поля из fields=a,b,c (author означает authorId), все по умолчанию, None при неизвестном поле.
+    
+    id выбирается всегда: по нему строятся курсоры и голоса.
+    """
+    if not params.get('fields'):
+        return list(SHORT_FIELDS)
+    fields = ['id']
+    for name in params['fields'].split(','):
+        name = name.strip()
+        if name == 'author':
+            name = 'authorId'
+        if name not in SHORT_FIELDS:
+            return None
+        if name not in fields:
+            fields.append(name)
+    return fields
+
+def select_columns(fields: list) -> str:
+    return ', '.join(f'{SHORT_FIELDS[name]} AS "{name}"' for name in fields)
+
+def select_joins(fields: list) -> str:
+    """Шарды счётчиков нужны, только если выбраны likes или dislikes"""
+    return SHORT_JOINS if 'likes' in fields or 'dislikes' in fields else ''
+
+def drop_nulls(items: list) -> list:
+    return [{key: value for key, value in item.items() if value is not None} for item in items]
+
+SHORT_JOINS = """
+    LEFT JOIN LATERAL (
+        SELECT SUM(likes) AS likes, SUM(dislikes) AS dislikes
+        FROM short_counter_shards WHERE short_id = s.id
+    ) shards ON TRUE
+"""
+
+SEARCH_MAX_LENGTH = int(os.environ.get('SEARCH_MAX_LENGTH', '200'))
+
+def search_shorts(req: Request) -> dict:
+    """Полнотекстовый поиск клипов по названию (q) по GIN-индексу search_vector с русским стеммингом.
+    
+    Результаты идут по убыванию ts_rank_cd, курсор — (ранг, id) последнего элемента.
+    """
+    query = (req.params.get('q') or '').strip()
+    limit = get_page_size(req.params)
+    cursor = req.params.get('cursor')
+    position = decode_cursor(cursor, float) if cursor else None
+    
+    if not query or len(query) > SEARCH_MAX_LENGTH:
+        return error(400, 'Invalid search query')
+    if limit is None or (cursor and not position):
+        return error(400, 'Invalid cursor or limit')
+    
+    voter_id, failure = get_voter(req)
+    if failure:
+        return failure
+    
+    fields = get_fields(req.params)
+    if fields is None:
+        return error(400, 'Invalid fields')
+    columns, joins = select_columns(fields), select_joins(fields)
+    
+    where = 'AND (ts_rank_cd(s.search_vector, q)::float8, s.id) < (%s::float8, %s)' if position else ''
+    req.cur.execute(f"""
+        SELECT {columns}, ts_rank_cd(s.search_vector, q)::float8 AS sort_key
+        FROM shorts s
+        CROSS JOIN websearch_to_tsquery('russian', %s) q
+        {joins}
+        WHERE s.search_vector @@ q {where}
+        ORDER BY sort_key DESC, s.id DESC
+        LIMIT %s
+    """, (query, *(position or ()), limit + 1))
     
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor()
+    shorts = rows_to_dicts(req.cur, req.cur.fetchall())
+    has_more = len(shorts) > limit
+    shorts = shorts[:limit]
+    sort_keys = [short.pop('sort_key') for short in shorts]
+    shorts = drop_nulls(shorts)
+    next_cursor = encode_cursor(sort_keys[-1], shorts[-1]['id']) if has_more else None
     
+    if voter_id:
+        attach_votes(req.cur, shorts, voter_id)
+    authors = attach_authors(req.cur, shorts, req.params.get('authors') == 'map') if 'authorId' in fields else None
+    page = {'shorts': shorts, 'nextCursor': next_cursor, 'hasMore': has_more}
+    if authors is not None:
+        page['authors'] = authors
+    return respond(200, page)
+
+DELTA_MAX_ITEMS = int(os.environ.get('DELTA_MAX_ITEMS', '200'))
+
+def current_watermark(cur) -> str:
+    """Водяной знак для delta=: xmin текущего снимка, все транзакции до него уже видны"""
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    return cur.fetchone()[0]
+
+def get_delta(req: Request) -> dict:
+    """Изменения общей ленты с водяного знака delta=: новые клипы целиком
+    и [id, likes, dislikes, views] для остальных изменённых.
+    
+    Если журнал уже очищен ниже водяного знака или изменилось больше
+    DELTA_MAX_ITEMS клипов, ответ reset: клиент перечитывает первую страницу.
+    """
+    watermark = req.params['delta']
+    if not re.fullmatch(r'[0-9]{1,19}', watermark):
+        return error(400, 'Invalid delta watermark')
+    
+    req.cur.execute("""
+        SELECT pg_snapshot_xmin(pg_current_snapshot())::text,
+               %s::xid8 < COALESCE((SELECT pruned_below FROM change_log_bounds WHERE table_name = 'short_changes'), '0'::xid8)
+    """, (watermark,))
+    next_watermark, pruned = req.cur.fetchone()
+    if pruned:
+        return respond(200, {'reset': True, 'watermark': next_watermark})
+    
+    req.cur.execute(f"""
+        SELECT {select_columns(list(SHORT_FIELDS))}, c.created
+        FROM (
+            SELECT short_id, bool_or(created) AS created FROM short_changes
+            WHERE txid >= %s::xid8
+            GROUP BY short_id
+        ) c
+        JOIN shorts s ON s.id = c.short_id
+        {SHORT_JOINS}
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT %s
+    """, (watermark, DELTA_MAX_ITEMS + 1))
+    rows = rows_to_dicts(req.cur, req.cur.fetchall())
+    if len(rows) > DELTA_MAX_ITEMS:
+        return respond(200, {'reset': True, 'watermark': next_watermark})
+    
+    shorts, changes = [], []
+    for row in rows:
+        if row.pop('created'):
+            shorts.append(row)
+        else:
+            changes.append([row['id'], row['likes'], row['dislikes'], row['views']])
+    shorts = drop_nulls(shorts)
+    
+    authors = attach_authors(req.cur, shorts, req.params.get('authors') == 'map')
+    page = {'shorts': shorts, 'changes': changes, 'watermark': next_watermark}
+    if authors is not None:
+        page['authors'] = authors
+    return respond(200, page)
+
+def get_feed(req: Request) -> dict:
+    """Лента клипов, по времени или "в тренде" (sort=trending), с keyset-пагинацией"""
+    if 'q' in req.params:
+        return search_shorts(req)
+    if 'delta' in req.params:
+        return get_delta(req)
+    
+    snapshot_name = get_snapshot_name(req.params)
+    if snapshot_name:
+        snapshot = load_snapshot(req, snapshot_name)
+        if snapshot:
+            return snapshot_response(req, snapshot)
+    
+    cache_key = get_feed_cache_key(req.params)
+    if cache_key:
+        cached = cache_get(cache_key)
+        if cached:
+            return feed_response(req, *cached)
+    
+    trending = req.params.get('sort') == 'trending'
+    limit = get_page_size(req.params)
+    cursor = req.params.get('cursor')
+    since = req.params.get('since')
+    position = decode_cursor(since or cursor, float if trending else datetime.fromisoformat) if (since or cursor) else None
+    
+    if limit is None or ((since or cursor) and not position):
+        return error(400, 'Invalid cursor or limit')
+    
+    if trending and since:
+        return error(400, 'Trending feed does not support since')
+    
+    voter_id, failure = get_voter(req)
+    if failure:
+        return failure
+    
+    fields = get_fields(req.params)
+    if fields is None:
+        return error(400, 'Invalid fields')
+    columns, joins = select_columns(fields), select_joins(fields)
+    
+    # Первая страница общей ленты несёт водяной знак, с которого клиент опрашивает delta=
+    watermark = current_watermark(req.cur) if not (since or cursor or trending) else None
+    
+    # "В тренде" идёт по индексу (trend_score, id) так же, как хронология по (created_at, id)
+    sort_column = 's.trend_score' if trending else 's.created_at'
+    if since:
+        where, order = f'WHERE ({sort_column}, s.id) > (%s, %s)', 'ASC'
+    elif cursor:
+        where, order = f'WHERE ({sort_column}, s.id) < (%s, %s)', 'DESC'
+    else:
+        where, order = '', 'DESC'
+    
+    req.cur.execute(f"""
+        SELECT {columns}, {sort_column} AS sort_key
+        FROM shorts s
+        {joins}
+        {where}
+        ORDER BY {sort_column} {order}, s.id {order}
+        LIMIT %s
+    """, (*(position or ()), limit + 1))
+    
+    shorts = rows_to_dicts(req.cur, req.cur.fetchall())
+    has_more = len(shorts) > limit
+    shorts = shorts[:limit]
+    sort_keys = [short.pop('sort_key') for short in shorts]
+    shorts = drop_nulls(shorts)
+    
+    # prevCursor указывает на самую новую запись страницы: с него клиент запрашивает since=
+    if since:
+        shorts.reverse()
+        next_cursor = prev_cursor = encode_cursor(sort_keys[-1], shorts[0]['id']) if shorts else since
+    else:
+        next_cursor = encode_cursor(sort_keys[-1], shorts[-1]['id']) if has_more else None
+        prev_cursor = encode_cursor(sort_keys[0], shorts[0]['id']) if shorts and not trending else None
+    
+    if voter_id:
+        attach_votes(req.cur, shorts, voter_id)
+    authors = attach_authors(req.cur, shorts, req.params.get('authors') == 'map') if 'authorId' in fields else None
+    page = {'shorts': shorts, 'nextCursor': next_cursor, 'prevCursor': prev_cursor, 'hasMore': has_more}
+    if authors is not None:
+        page['authors'] = authors
+    if watermark is not None:
+        page['watermark'] = watermark
+    if not cache_key:
+        return respond(200, page)
+    
+    body = json_dumps(page)
+    etag = make_etag(body)
+    if snapshot_name:
+        return snapshot_response(req, store_snapshot(req, snapshot_name, etag, body))
+    cache_set(cache_key, (etag, body))
+    return feed_response(req, etag, body)
+
+def insert_short(cur, user_id: int, fields: dict) -> dict:
+    """Создать клип без коммита.
+    
+    Возвращает клип в формате ответа без author, ValueError при неверных полях.
+    """
+    title = fields.get('title')
+    video_url = fields.get('videoUrl')
+    thumbnail_url = fields.get('thumbnailUrl')
+    duration = fields.get('duration', 0)
+    
+    if not title or not video_url:
+        raise ValueError('Title and video URL are required')
+    
+    cur.execute("""
+        WITH short AS (
+            INSERT INTO shorts (user_id, title, video_url, thumbnail_url, duration)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, created_at
+        ), logged AS (
+            INSERT INTO short_changes (short_id, created) SELECT id, TRUE FROM short
+        )
+        SELECT id, created_at FROM short
+    """, (user_id, title, video_url, thumbnail_url, duration))
+    
+    short_id, created_at = cur.fetchone()
+    
+    return {
+        'id': short_id,
+        'title': title,
+        'videoUrl': video_url,
+        'thumbnailUrl': thumbnail_url,
+        'duration': duration,
+        'likes': 0,
+        'dislikes': 0,
+        'views': 0,
+        'timestamp': created_at
+    }
+
+@authenticated
+@rate_limited('create', per_minute=6, burst=5)
+def create_short(req: Request) -> dict:
     try:
-        if method == 'GET':
-            cur.execute("""
-                SELECT 
-                    s.id, s.title, s.video_url, s.thumbnail_url, s.duration,
-                    s.likes, s.dislikes, s.views, s.created_at,
-                    u.id, u.username, u.avatar
-                FROM shorts s
-                JOIN users u ON s.user_id = u.id
-                ORDER BY s.created_at DESC
-                LIMIT 50
-            """)
-            
-            shorts = []
-            for row in cur.fetchall():
-                shorts.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'videoUrl': row[2],
-                    'thumbnailUrl': row[3],
-                    'duration': row[4],
-                    'likes': row[5],
-                    'dislikes': row[6],
-                    'views': row[7],
-                    'timestamp': row[8].isoformat() if row[8] else None,
-                    'author': {
-                        'id': row[9],
-                        'username': row[10],
-                        'avatar': row[11]
-                    }
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'shorts': shorts}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            auth_header = event.get('headers', {}).get('X-Authorization', '')
-            user_id = get_user_from_token(auth_header, jwt_secret)
-            
-            if not user_id:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Unauthorized'}),
-                    'isBase64Encoded': False
-                }
-            
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'create':
-                title = body.get('title')
-                video_url = body.get('videoUrl')
-                thumbnail_url = body.get('thumbnailUrl')
-                duration = body.get('duration', 0)
-                
-                if not title or not video_url:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Title and video URL are required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute("""
-                    INSERT INTO shorts (user_id, title, video_url, thumbnail_url, duration)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id, created_at
-                """, (user_id, title, video_url, thumbnail_url, duration))
-                
-                short_id, created_at = cur.fetchone()
-                conn.commit()
-                
-                cur.execute("SELECT username, avatar FROM users WHERE id = %s", (user_id,))
-                username, avatar = cur.fetchone()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'short': {
-                            'id': short_id,
-                            'title': title,
-                            'videoUrl': video_url,
-                            'thumbnailUrl': thumbnail_url,
-                            'duration': duration,
-                            'likes': 0,
-                            'dislikes': 0,
-                            'views': 0,
-                            'timestamp': created_at.isoformat(),
-                            'author': {
-                                'id': user_id,
-                                'username': username,
-                                'avatar': avatar
-                            }
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'like':
-                short_id = body.get('shortId')
-                is_like = body.get('isLike', True)
-                
-                cur.execute("""
-                    INSERT INTO short_likes (user_id, short_id, is_like)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id, short_id) 
-                    DO UPDATE SET is_like = %s
-                """, (user_id, short_id, is_like, is_like))
-                
-                if is_like:
-                    cur.execute("UPDATE shorts SET likes = likes + 1 WHERE id = %s", (short_id,))
-                else:
-                    cur.execute("UPDATE shorts SET dislikes = dislikes + 1 WHERE id = %s", (short_id,))
-                
-                conn.commit()
-                
-                cur.execute("SELECT likes, dislikes FROM shorts WHERE id = %s", (short_id,))
-                likes, dislikes = cur.fetchone()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'likes': likes, 'dislikes': dislikes}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'view':
-                short_id = body.get('shortId')
-                cur.execute("UPDATE shorts SET views = views + 1 WHERE id = %s", (short_id,))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
+        short = insert_short(req.cur, req.user_id, req.body)
+    except ValueError as e:
+        return error(400, str(e))
+    
+    drop_snapshots(req.cur)
+    req.conn.commit()
+    invalidate_feed_cache()
+    
+    short['author'] = get_authors(req.cur, [req.user_id]).get(req.user_id)
+    return respond(201, {'short': short})
+
+@authenticated
+@rate_limited('like', per_minute=60, burst=30)
+def like_short(req: Request) -> dict:
+    short_id, is_like = req.body.get('shortId'), req.body.get('isLike', True)
+    if not is_valid_vote(short_id, is_like):
+        return error(400, 'Invalid vote')
+    
+    counts = apply_votes(req.cur, req.user_id, {short_id: is_like})
+    if short_id not in counts:
+        closed = short_id in archived_shorts(req.cur, [short_id])
+        req.conn.rollback()
+        if closed:
+            return error(409, 'Voting is closed for this short')
+        return error(404, 'Short not found')
+    
+    req.conn.commit()
+    invalidate_feed_cache()
+    likes, dislikes = counts[short_id]
+    return respond(200, {'likes': likes, 'dislikes': dislikes})
+
+@authenticated
+@rate_limited('view', per_minute=300, burst=100)
+def view_short(req: Request) -> dict:
+    short_ids = req.body.get('shortIds') or [req.body.get('shortId')]
+    
+    if (not isinstance(short_ids, list) or len(short_ids) > VIEW_BATCH_MAX
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in short_ids)):
+        return error(400, 'Invalid short ids')
+    
+    accepted = buffer_views(req.cur, short_ids, get_viewer_key(req.user_id, req.body.get('sessionId')))
+    req.conn.commit()
+    return respond(200, {'success': True, 'accepted': len(accepted)})
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '50'))
+
+@authenticated
+@rate_limited('batch', per_minute=30, burst=10)
+def run_batch(req: Request) -> dict:
+    """Несколько действий одним запросом и одной транзакцией.
+    
+    {"action": "batch", "items": [{"action": "view", ...}, {"action": "like", ...}]}:
+    все просмотры пишутся одним INSERT в буфер, все лайки — одним запросом
+    apply_votes, создания идут по очереди под своими точками сохранения.
+    Ответ — results в порядке items.
+    """
+    items = req.body.get('items')
+    if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ITEMS:
+        return error(400, 'Invalid batch')
+    
+    # Каждое действие списывает токен своего bucket'а, как отдельный запрос;
+    # действия сверх лимита получают 429, остальные выполняются
+    allowed = {}
+    for action in ('create', 'like', 'view'):
+        wanted = sum(1 for item in items if isinstance(item, dict) and item.get('action') == action)
+        allowed[action] = take_rate(req, action, wanted)[0] if wanted else 0
+    
+    results = [None] * len(items)
+    votes, views = {}, []
+    for i, item in enumerate(items):
+        action = item.get('action') if isinstance(item, dict) else None
+        if action in allowed:
+            if not allowed[action]:
+                results[i] = {'status': 429, 'error': 'Too many requests'}
+                continue
+            allowed[action] -= 1
+        if action == 'view':
+            if isinstance(item.get('shortId'), int) and not isinstance(item['shortId'], bool):
+                views.append(item['shortId'])
             else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid action'}),
-                    'isBase64Encoded': False
-                }
-        
+                results[i] = {'status': 400, 'error': 'Invalid short id'}
+        elif action == 'like':
+            short_id, is_like = item.get('shortId'), item.get('isLike', True)
+            if is_valid_vote(short_id, is_like):
+                votes[short_id] = is_like
+            else:
+                results[i] = {'status': 400, 'error': 'Invalid vote'}
+        elif action == 'create':
+            req.cur.execute("SAVEPOINT batch_item")
+            try:
+                results[i] = {'status': 201, 'short': insert_short(req.cur, req.user_id, item)}
+            except ValueError as e:
+                results[i] = {'status': 400, 'error': str(e)}
+            except (psycopg2.DataError, psycopg2.IntegrityError):
+                req.cur.execute("ROLLBACK TO SAVEPOINT batch_item")
+                results[i] = {'status': 400, 'error': 'Invalid short'}
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+            results[i] = {'status': 400, 'error': 'Invalid action'}
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    counts = apply_votes(req.cur, req.user_id, votes) if votes else {}
+    missing = votes.keys() - counts.keys()
+    closed = archived_shorts(req.cur, missing) if missing else set()
+    accepted = collections.Counter(
+        buffer_views(req.cur, views, get_viewer_key(req.user_id, req.body.get('sessionId'))) if views else []
+    )
+    for i, item in enumerate(items):
+        if results[i] is not None:
+            continue
+        short_id = item['shortId']
+        if item['action'] == 'view':
+            results[i] = {'status': 200, 'accepted': accepted[short_id] > 0}
+            accepted[short_id] -= 1
+        elif short_id in counts:
+            likes, dislikes = counts[short_id]
+            results[i] = {'status': 200, 'likes': likes, 'dislikes': dislikes}
+        elif short_id in closed:
+            results[i] = {'status': 409, 'error': 'Voting is closed for this short'}
+        else:
+            results[i] = {'status': 404, 'error': 'Short not found'}
+    
+    created = [result['short'] for result in results if result['status'] == 201]
+    if created:
+        drop_snapshots(req.cur)
+    req.conn.commit()
+    if created or counts:
+        invalidate_feed_cache()
+    if created:
+        author = get_authors(req.cur, [req.user_id]).get(req.user_id)
+        for short in created:
+            short['author'] = author
+    
+    return respond(200, {'results': results})
+
+ROUTES = {
+    ('GET', None): get_feed,
+    ('POST', 'create'): create_short,
+    ('POST', 'like'): like_short,
+    ('POST', 'view'): view_short,
+    ('POST', 'batch'): run_batch,
+}
+
+PREFLIGHT = preflight_response(ROUTES)
+
+def handler(event: dict, context) -> dict:
+    """API для работы с клипами и шортсами"""
+    return dispatch(event, context, ROUTES, PREFLIGHT)
@@ -0,0 +1,44 @@
+"""Проверка, что общий каркас одинаков во всех функциях, которые его копируют.
+
+    python bench/check_shared.py
+
+Блок от "# Общий каркас функций" до "# Конец общего каркаса" сравнивается
+с копией в первой функции; при расхождении печатается diff и код выхода 1.
+"""
+import difflib
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FUNCTIONS = ('auth', 'posts', 'shorts')
+START_MARKER = '# Общий каркас функций'
+END_MARKER = '# Конец общего каркаса'
+
+def shared_block(name: str) -> list:
+    """Строки общего каркаса из backend/<name>/index.py"""
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    starts = [i for i, line in enumerate(lines) if line.startswith(START_MARKER)]
+    ends = [i for i, line in enumerate(lines) if line.startswith(END_MARKER)]
+    if len(starts) != 1 or len(ends) != 1 or ends[0] < starts[0]:
+        raise ValueError(f'{path}: expected one "{START_MARKER}" ... "{END_MARKER}" block')
+    return lines[starts[0]:ends[0] + 1]
+
+def main() -> int:
+    reference, *others = FUNCTIONS
+    expected = shared_block(reference)
+    drifted = False
+    for name in others:
+        diff = list(difflib.unified_diff(expected, shared_block(name), f'{reference}/index.py', f'{name}/index.py'))
+        if diff:
+            drifted = True
+            sys.stdout.writelines(diff)
+    if drifted:
+        print('shared block differs between functions', file=sys.stderr)
+        return 1
+    print(f'shared block identical in {", ".join(FUNCTIONS)}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
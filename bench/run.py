@@ -0,0 +1,275 @@
+"""Офлайн-бенчмарк функций backend/*: прямые вызовы handler(event, context) на локальном Postgres.
+
+    python bench/run.py --database-url postgresql://localhost/bench --reset --users 2000 --requests 5000
+    python bench/run.py --database-url ... --reset --json report.json
+    python bench/run.py --database-url ... --reset --baseline report.json
+    python bench/run.py --database-url ... --reset --cold-start-budget 100
+
+База по --database-url полностью пересоздаётся, поэтому нужен --reset и
+отдельная база только для бенчмарка.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import bcrypt
+import psycopg2
+
+import check_shared
+from seed import BENCH_PASSWORD, apply_migrations, seed
+from workload import DEFAULT_MIX, Workload, parse_mix, read_replay
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FUNCTIONS = ('auth', 'posts', 'shorts')
+
+class Context:
+    """Минимальный context облачной функции для строк лога"""
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.request_id = None
+
+def load_function(name: str):
+    """Загрузить backend/<name>/index.py и перехватывать его трассы запросов"""
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    spec = importlib.util.spec_from_file_location(f'{name}_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    
+    class RecordingTrace(module.Trace):
+        def finish(self, context, response):
+            super().finish(context, response)
+            module.last_trace = self
+    
+    module.Trace = RecordingTrace
+    module.last_trace = None
+    return module
+
+# Первый запрос холодного контейнера: анонимные чтения, с которых начинает SPA
+COLD_START_EVENTS = {
+    'auth': {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'q': 'bench'}},
+    'posts': {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'authors': 'map'}},
+    'shorts': {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'authors': 'map'}},
+}
+
+# Выполняется в чистом интерпретаторе: загрузка модуля, preflight, первый запрос.
+# Метки в stderr делят вывод -X importtime на импорты при загрузке и при первом запросе
+COLD_START_SCRIPT = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+sys.stderr.write('-- load\\n')
+spec = importlib.util.spec_from_file_location('function_index', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+loaded = time.perf_counter()
+module.handler({'httpMethod': 'OPTIONS'}, None)
+preflight = time.perf_counter()
+sys.stderr.write('-- first\\n')
+status = module.handler(json.loads(sys.argv[2]), None)['statusCode']
+first = time.perf_counter()
+sys.stderr.write('-- end\\n')
+print(json.dumps({'load_ms': (loaded - started) * 1000, 'options_ms': (preflight - loaded) * 1000,
+                  'first_ms': (first - preflight) * 1000, 'status': status}))
+"""
+
+def parse_importtime(stderr: str) -> dict:
+    """Импорты верхнего уровня из -X importtime по участкам load и first: {участок: {модуль: мс}}"""
+    sections, section = {'load': {}, 'first': {}}, None
+    for line in stderr.splitlines():
+        if line.startswith('-- '):
+            section = line[3:].strip()
+        elif line.startswith('import time:') and section in sections:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit() and not name.startswith('  '):
+                sections[section][name.strip()] = int(cumulative) / 1000
+    return sections
+
+def measure_cold_start(name: str, runs: int) -> dict:
+    """Холодный старт функции в отдельных процессах: медианы по runs запускам и разбивка импортов"""
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    command = [sys.executable, '-c', COLD_START_SCRIPT, path, json.dumps(COLD_START_EVENTS[name])]
+    samples = [json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout) for _ in range(runs)]
+    profiled = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], capture_output=True, text=True, check=True)
+    
+    result = {key: statistics.median(sample[key] for sample in samples) for key in ('load_ms', 'options_ms', 'first_ms')}
+    result['total_ms'] = result['load_ms'] + result['first_ms']
+    result['status'] = samples[-1]['status']
+    result['imports'] = parse_importtime(profiled.stderr)
+    return result
+
+def print_cold_start(report: dict, budget: float):
+    print(f"{'cold start':<18}{'load ms':>9}{'options':>9}{'first ms':>9}{'total ms':>9}  status")
+    for name, row in report.items():
+        over = f'  > budget {budget:.0f}ms' if budget and row['total_ms'] > budget else ''
+        print(f"{name:<18}{row['load_ms']:>9.2f}{row['options_ms']:>9.3f}{row['first_ms']:>9.2f}{row['total_ms']:>9.2f}  {row['status']}{over}")
+        for section, label in (('load', 'imports at load'), ('first', 'imports on first request')):
+            heaviest = sorted(row['imports'][section].items(), key=lambda item: -item[1])[:5]
+            if heaviest:
+                print(f"  {label}: " + ', '.join(f'{module} {ms:.1f}' for module, ms in heaviest))
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class Stats:
+    """Время, число запросов к БД и статусы по каждому действию"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.queries = {}
+        self.statuses = {}
+    
+    def add(self, name: str, seconds: float, queries, status):
+        self.latencies.setdefault(name, []).append(seconds)
+        if queries is not None:
+            self.queries.setdefault(name, []).append(queries)
+        counts = self.statuses.setdefault(name, {})
+        counts[status] = counts.get(status, 0) + 1
+    
+    def report(self) -> dict:
+        result = {}
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            queries = self.queries.get(name, [])
+            result[name] = {
+                'count': len(values),
+                'rps': len(values) / sum(values) if sum(values) else 0.0,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': values[-1] * 1000,
+                'queries_per_request': sum(queries) / len(queries) if queries else 0.0,
+                'statuses': {str(status): count for status, count in sorted(self.statuses[name].items(), key=str)},
+            }
+        return result
+
+def run(functions: dict, requests, stats: Stats = None) -> Stats:
+    """Прогнать запросы по очереди, как их обрабатывает один контейнер функции"""
+    stats = stats or Stats()
+    for name, function, event in requests:
+        module = functions[function]
+        module.last_trace = None
+        started = time.perf_counter()
+        try:
+            status = module.handler(event, Context(function))['statusCode']
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        trace = module.last_trace
+        stats.add(name, elapsed, len(trace.queries) if trace else None, status)
+    return stats
+
+def print_report(report: dict, wall_seconds: float, total: int):
+    print(f'{total} requests in {wall_seconds:.2f}s, {total / wall_seconds:.1f} req/s')
+    print(f"{'action':<18}{'count':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'q/req':>7}  statuses")
+    for name, row in report.items():
+        statuses = ' '.join(f'{status}:{count}' for status, count in row['statuses'].items())
+        print(
+            f"{name:<18}{row['count']:>7}{row['rps']:>9.1f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+            f"{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}{row['queries_per_request']:>7.2f}  {statuses}"
+        )
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Регрессии относительно прошлого отчёта: p95 или число запросов выросли больше threshold раз"""
+    regressions = []
+    for name, row in report.items():
+        before = baseline.get('actions', {}).get(name)
+        if not before:
+            continue
+        if before['p95_ms'] > 0 and row['p95_ms'] > before['p95_ms'] * threshold:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f}ms -> {row['p95_ms']:.2f}ms")
+        if row['queries_per_request'] > before['queries_per_request'] + 0.01:
+            regressions.append(f"{name}: queries/request {before['queries_per_request']:.2f} -> {row['queries_per_request']:.2f}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--reset', action='store_true', help='пересоздать схему базы и заполнить её заново')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--shorts', type=int, default=5000)
+    parser.add_argument('--subscriptions', type=int, default=20000)
+    parser.add_argument('--votes', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100, help='запросы до замеров, в отчёт не попадают')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='например "posts.feed=30,auth.login=1"')
+    parser.add_argument('--replay', help='JSONL с записанными событиями вместо синтетической нагрузки')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+    parser.add_argument('--baseline', help='отчёт прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.25, help='допустимый рост p95 относительно baseline')
+    parser.add_argument('--cold-start-runs', type=int, default=5, help='запусков на функцию для замера холодного старта, 0 — не замерять')
+    parser.add_argument('--cold-start-budget', type=float, default=150, help='допустимые загрузка и первый запрос холодного контейнера, мс')
+    args = parser.parse_args(argv)
+    
+    if not args.database_url:
+        parser.error('--database-url or BENCH_DATABASE_URL is required')
+    if not args.reset:
+        parser.error('the benchmark drops and reseeds the database, pass --reset to confirm')
+    # Разошедшиеся копии общего каркаса меряют не тот код, что задеплоен в соседних функциях
+    if check_shared.main():
+        return 1
+    
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('TRACE_LOG', '0')
+    # Бенчмарк шлёт запросы быстрее любого клиента: лимиты остаются в пути запроса, но не срабатывают
+    os.environ.setdefault('RATE_LIMIT_SCALE', '100000')
+    
+    conn = psycopg2.connect(args.database_url)
+    started = time.perf_counter()
+    apply_migrations(conn)
+    functions = {name: load_function(name) for name in FUNCTIONS}
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=functions['auth'].BCRYPT_ROUNDS))
+    scale = {name: getattr(args, name) for name in ('users', 'posts', 'shorts', 'subscriptions', 'votes')}
+    data = seed(conn, scale, password_hash.decode('utf-8'), seed_value=(args.seed % 1000) / 1000)
+    conn.close()
+    print(f"seeded {scale} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    
+    if args.replay:
+        requests = list(read_replay(args.replay))
+        warmup, measured = requests[:args.warmup], requests[args.warmup:]
+    else:
+        workload = Workload(data, functions['auth'].issue_token, args.mix, args.seed)
+        warmup = [workload.next() for _ in range(args.warmup)]
+        measured = [workload.next() for _ in range(args.requests)]
+    
+    run(functions, warmup)
+    started = time.perf_counter()
+    stats = run(functions, measured)
+    wall_seconds = time.perf_counter() - started
+    
+    report = stats.report()
+    print_report(report, wall_seconds, len(measured))
+    
+    cold_start = {name: measure_cold_start(name, args.cold_start_runs) for name in FUNCTIONS} if args.cold_start_runs > 0 else {}
+    if cold_start:
+        print()
+        print_cold_start(cold_start, args.cold_start_budget)
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'scale': scale, 'requests': len(measured), 'seconds': wall_seconds, 'actions': report, 'cold_start': cold_start}, f, indent=2)
+    
+    failures = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            failures += [f'REGRESSION {line}' for line in compare(report, json.load(f), args.threshold)]
+    failures += [
+        f"COLD START {name}: {row['total_ms']:.1f}ms > {args.cold_start_budget:.0f}ms"
+        for name, row in cold_start.items() if row['total_ms'] > args.cold_start_budget
+    ]
+    for line in failures:
+        print(line)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Подготовка локальной базы для бенчмарка: миграции и синтетические данные"""
+import glob
+import os
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_migrations')
+
+BENCH_PASSWORD = 'bench-password'
+
+# Словарь для текстов постов: поисковые запросы совпадают с долей постов, а не со всеми
+CONTENT_WORDS = (
+    'киберпанк мод Minecraft неоновые блоки оружие город релиз обновление текстуры шейдеры '
+    'сервер выживание крафт броня дракон портал редстоун механизмы карта приключение '
+    'новости стрим видео скриншот сборка версия исправление баг оптимизация фермы '
+    'деревня замок подземелье зелье магия робот лазер дрон голограмма трасса гонка'
+).split()
+
+def apply_migrations(conn):
+    """Пересоздать схему public и прогнать все db_migrations/V*.sql по порядку"""
+    cur = conn.cursor()
+    cur.execute("DROP SCHEMA public CASCADE")
+    cur.execute("CREATE SCHEMA public")
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        with open(path, encoding='utf-8') as f:
+            cur.execute(f.read())
+    conn.commit()
+    cur.close()
+
+def seed(conn, scale: dict, password_hash: str, seed_value: float = 0.42):
+    """Заполнить базу данными заданного масштаба.
+
+    Популярность авторов и контента неравномерная: random() в квадрате
+    смещает выбор к меньшим id, как у реальных лент с явными лидерами.
+    Счётчики, таймлайны и счётчики подписок заполняются так же, как это
+    делают миграции и задачи обслуживания.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT setseed(%s)", (seed_value,))
+    
+    cur.execute("""
+        INSERT INTO users (username, email, password_hash, created_at)
+        SELECT 'bench_' || g, 'bench_' || g || '@example.com', %s,
+               CURRENT_TIMESTAMP - random() * INTERVAL '365 days'
+        FROM generate_series(1, %s) g
+    """, (password_hash, scale['users']))
+    cur.execute("SELECT MIN(id), MAX(id) FROM users")
+    users = dict(zip(('lo', 'hi'), cur.fetchone()))
+    users['n'] = users['hi'] - users['lo'] + 1
+    popular_user = "%(lo)s + FLOOR(POWER(random(), 2) * %(n)s)::int"
+    any_user = "%(lo)s + FLOOR(random() * %(n)s)::int"
+    
+    cur.execute(f"""
+        INSERT INTO posts (user_id, content, post_type, media_url, video_url, mod_link, views, created_at)
+        SELECT {popular_user},
+               (SELECT string_agg(words[1 + FLOOR(random() * array_length(words, 1))::int], ' ' ORDER BY i)
+                FROM generate_series(1, 4 + mod(g, 12)) i),
+               (ARRAY['text', 'text', 'image', 'video', 'mod'])[1 + mod(g, 5)],
+               CASE WHEN mod(g, 5) = 2 THEN 'https://cdn.example.com/img/' || g || '.jpg' END,
+               CASE WHEN mod(g, 5) = 3 THEN 'https://cdn.example.com/video/' || g || '.mp4' END,
+               CASE WHEN mod(g, 5) = 4 THEN 'https://mods.example.com/' || g END,
+               FLOOR(random() * 5000)::int,
+               CURRENT_TIMESTAMP - random() * INTERVAL '30 days'
+        FROM generate_series(1, %(count)s) g, (SELECT %(words)s::text[] AS words) vocabulary
+    """, {**users, 'count': scale['posts'], 'words': CONTENT_WORDS})
+
+    cur.execute(f"""
+        INSERT INTO shorts (user_id, title, video_url, thumbnail_url, duration, views, created_at)
+        SELECT {popular_user}, 'Клип #' || g,
+               'https://cdn.example.com/shorts/' || g || '.mp4',
+               'https://cdn.example.com/shorts/' || g || '.jpg',
+               5 + FLOOR(random() * 55)::int,
+               FLOOR(random() * 20000)::int,
+               CURRENT_TIMESTAMP - random() * INTERVAL '30 days'
+        FROM generate_series(1, %(count)s) g
+    """, {**users, 'count': scale['shorts']})
+
+    cur.execute(f"""
+        INSERT INTO subscriptions (follower_id, following_id)
+        SELECT follower_id, following_id FROM (
+            SELECT {any_user} AS follower_id, {popular_user} AS following_id
+            FROM generate_series(1, %(count)s)
+        ) pairs
+        WHERE follower_id <> following_id
+        ON CONFLICT DO NOTHING
+    """, {**users, 'count': scale['subscriptions']})
+
+    for table, votes, key in (('posts', 'post_likes', 'post_id'), ('shorts', 'short_likes', 'short_id')):
+        cur.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+        lo, hi = cur.fetchone()
+        if lo is None:
+            continue
+        cur.execute("SELECT ensure_vote_partitions(%s, %s, %s)", (votes, key, hi))
+        cur.execute(f"""
+            INSERT INTO {votes} (user_id, {key}, is_like, trended)
+            SELECT user_id, item_id, is_like, is_like FROM (
+                SELECT {any_user} AS user_id, %(item_lo)s + FLOOR(POWER(random(), 2) * %(items)s)::int AS item_id, random() < 0.85 AS is_like
+                FROM generate_series(1, %(count)s)
+            ) v
+            ON CONFLICT DO NOTHING
+        """, {**users, 'item_lo': lo, 'items': hi - lo + 1, 'count': scale['votes']})
+        cur.execute(f"""
+            UPDATE {table} t
+            SET likes = v.likes, dislikes = v.dislikes
+            FROM (
+                SELECT {key} AS id,
+                       COUNT(*) FILTER (WHERE is_like) AS likes,
+                       COUNT(*) FILTER (WHERE NOT is_like) AS dislikes
+                FROM {votes}
+                GROUP BY {key}
+            ) v
+            WHERE t.id = v.id
+        """)
+        cur.execute(f"UPDATE {table} SET trend_score = trend_point(1 + likes + views * 0.1, created_at)")
+
+    cur.execute("""
+        UPDATE users u SET
+            followers_count = (SELECT COUNT(*) FROM subscriptions WHERE following_id = u.id),
+            following_count = (SELECT COUNT(*) FROM subscriptions WHERE follower_id = u.id)
+    """)
+    cur.execute("""
+        INSERT INTO timelines (user_id, post_id, created_at)
+        SELECT s.follower_id, p.id, p.created_at
+        FROM posts p
+        JOIN subscriptions s ON s.following_id = p.user_id
+        JOIN users u ON u.id = p.user_id AND NOT u.fanout_on_read
+        UNION ALL
+        SELECT p.user_id, p.id, p.created_at
+        FROM posts p
+        ON CONFLICT DO NOTHING
+    """)
+    conn.commit()
+    
+    conn.autocommit = True
+    cur.execute("ANALYZE")
+    conn.autocommit = False
+    
+    cur.execute("SELECT id, username FROM users WHERE username LIKE 'bench\\_%' ORDER BY id")
+    bench_users = cur.fetchall()
+    cur.execute("SELECT (SELECT array_agg(id) FROM posts), (SELECT array_agg(id) FROM shorts)")
+    post_ids, short_ids = cur.fetchone()
+    cur.close()
+    return {'users': bench_users, 'posts': post_ids or [], 'shorts': short_ids or []}
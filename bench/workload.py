@@ -0,0 +1,165 @@
+"""Генерация и чтение нагрузки: события handler(event, context) по функциям"""
+import json
+import random
+
+from seed import BENCH_PASSWORD
+
+# Доли действий в смешанной нагрузке по умолчанию: чтение лент преобладает
+DEFAULT_MIX = {
+    'posts.feed': 30,
+    'posts.feed_page': 8,
+    'posts.trending': 5,
+    'posts.following': 12,
+    'posts.feed_votes': 6,
+    'posts.like': 8,
+    'posts.create': 2,
+    'shorts.feed': 15,
+    'shorts.trending': 5,
+    'shorts.like': 5,
+    'shorts.view': 12,
+    'shorts.batch': 3,
+    'auth.verify': 5,
+    'auth.login': 1,
+    'auth.subscribe': 2,
+    'posts.search': 3,
+    'shorts.search': 2,
+    'auth.search': 2,
+}
+
+SEARCH_TERMS = ['мод', 'киберпанк', 'minecraft', 'клип', 'моды для minecraft', 'неон']
+
+def parse_mix(value: str) -> dict:
+    """Разобрать строку вида "posts.feed=30,auth.login=1" в словарь долей"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f'Unknown action {name.strip()!r}, expected one of {", ".join(DEFAULT_MIX)}')
+        mix[name.strip()] = float(weight)
+    return mix
+
+# Первые страницы лент браузер запрашивает так же, как SPA: с authors=map и сжатием
+BROWSER_HEADERS = {'Accept-Encoding': 'gzip, deflate, br'}
+
+def _get(params=None, headers=None) -> dict:
+    return {'httpMethod': 'GET', 'headers': headers or {}, 'queryStringParameters': params or {}}
+
+def _post(body: dict, headers=None) -> dict:
+    return {'httpMethod': 'POST', 'headers': headers or {}, 'queryStringParameters': {}, 'body': json.dumps(body)}
+
+class Workload:
+    """Смешанная нагрузка по сидированным данным.
+
+    Пользователи выбираются неравномерно, чтобы активное меньшинство
+    повторно попадало в кэши профилей и лент, как в реальном трафике.
+    """
+
+    def __init__(self, data: dict, issue_token, mix: dict, seed_value: int):
+        self.data = data
+        self.issue_token = issue_token
+        self.rng = random.Random(seed_value)
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self._tokens = {}
+        self._posts = sorted(data['posts'], reverse=True)
+        self._shorts = sorted(data['shorts'], reverse=True)
+    
+    def _user(self):
+        users = self.data['users']
+        return users[int(self.rng.random() ** 2 * len(users))]
+    
+    def _auth(self, user) -> dict:
+        if user[0] not in self._tokens:
+            self._tokens[user[0]] = self.issue_token(user[0], user[1])
+        return {'X-Authorization': f'Bearer {self._tokens[user[0]]}'}
+    
+    def _item(self, ids: list):
+        # Новые записи получают больше внимания, чем старые
+        return ids[int(self.rng.random() ** 3 * len(ids))]
+    
+    def next(self):
+        """Очередной запрос: (имя действия, функция, событие)"""
+        name = self.rng.choices(self.names, self.weights)[0]
+        return (name, name.split('.')[0], getattr(self, '_' + name.replace('.', '_'))())
+    
+    def _posts_feed(self):
+        return _get({'authors': 'map'}, BROWSER_HEADERS)
+    
+    def _posts_feed_page(self):
+        return _get({'limit': str(self.rng.choice([10, 20, 50]))})
+    
+    def _posts_trending(self):
+        return _get({'authors': 'map', 'sort': 'trending'}, BROWSER_HEADERS)
+    
+    def _posts_feed_votes(self):
+        return _get({'votes': 'mine'}, self._auth(self._user()))
+    
+    def _posts_following(self):
+        return _get({'feed': 'following'}, self._auth(self._user()))
+    
+    def _posts_like(self):
+        is_like = self.rng.choice([True, True, True, False, None])
+        return _post({'action': 'like', 'postId': self._item(self._posts), 'isLike': is_like}, self._auth(self._user()))
+    
+    def _posts_create(self):
+        content = f'Бенчмарк пост {self.rng.randrange(10 ** 9)}'
+        return _post({'action': 'create', 'content': content, 'type': 'text'}, self._auth(self._user()))
+    
+    def _shorts_feed(self):
+        return _get({'authors': 'map'}, BROWSER_HEADERS)
+    
+    def _shorts_trending(self):
+        return _get({'authors': 'map', 'sort': 'trending'}, BROWSER_HEADERS)
+    
+    def _shorts_like(self):
+        return _post({'action': 'like', 'shortId': self._item(self._shorts), 'isLike': self.rng.random() < 0.85}, self._auth(self._user()))
+    
+    def _shorts_view(self):
+        short_ids = [self._item(self._shorts) for _ in range(self.rng.randint(1, 5))]
+        return _post({'action': 'view', 'shortIds': short_ids, 'sessionId': f's{self.rng.randrange(1000)}'}, self._auth(self._user()))
+    
+    def _shorts_batch(self):
+        # Пролистывание ленты клипов: пачка просмотров и пара лайков одним запросом
+        items = [{'action': 'view', 'shortId': self._item(self._shorts)} for _ in range(self.rng.randint(5, 20))]
+        items += [{'action': 'like', 'shortId': self._item(self._shorts), 'isLike': True} for _ in range(self.rng.randint(0, 3))]
+        return _post({'action': 'batch', 'items': items}, self._auth(self._user()))
+    
+    def _auth_verify(self):
+        return _post({'action': 'verify'}, self._auth(self._user()))
+    
+    def _auth_login(self):
+        return _post({'action': 'login', 'username': self._user()[1], 'password': BENCH_PASSWORD})
+    
+    def _auth_subscribe(self):
+        action = self.rng.choice(['subscribe', 'unsubscribe'])
+        return _post({'action': action, 'userId': self._user()[0]}, self._auth(self._user()))
+    
+    def _posts_search(self):
+        return _get({'q': self.rng.choice(SEARCH_TERMS)})
+    
+    def _shorts_search(self):
+        return _get({'q': self.rng.choice(SEARCH_TERMS)})
+    
+    def _auth_search(self):
+        return _get({'q': self._user()[1][:self.rng.randint(1, 8)]})
+
+def read_replay(path: str):
+    """Прочитать записанный трафик: JSON-строки {"function": "posts", "event": {...}}.
+
+    Необязательное поле "name" задаёт подпись в отчёте, иначе она
+    собирается из функции и action.
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            event = record['event']
+            name = record.get('name')
+            if not name:
+                try:
+                    action = json.loads(event.get('body') or '{}').get('action')
+                except (ValueError, AttributeError):
+                    action = None
+                name = f"{record['function']}.{action or event.get('httpMethod', 'GET').lower()}"
+            yield name, record['function'], event
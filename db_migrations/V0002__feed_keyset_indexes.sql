@@ -0,0 +1,7 @@
+-- Составные индексы для keyset-пагинации лент: (created_at, id) с тай-брейкером по id
+CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_shorts_created_at_id ON shorts(created_at DESC, id DESC);
+
+-- Старые индексы только по created_at покрываются новыми
+DROP INDEX IF EXISTS idx_posts_created_at;
+DROP INDEX IF EXISTS idx_shorts_created_at;
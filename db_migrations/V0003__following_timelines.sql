@@ -0,0 +1,29 @@
+-- Предрассчитанные ленты подписок (fan-out-on-write)
+CREATE TABLE IF NOT EXISTS timelines (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, created_at, post_id)
+);
+
+-- Авторы с огромной аудиторией: посты подмешиваются при чтении (fan-out-on-read)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS fanout_on_read BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE users SET fanout_on_read = TRUE WHERE username = 'JJRKDOEMYT';
+
+-- Посты конкретного автора по времени для чтения лент знаменитостей
+CREATE INDEX IF NOT EXISTS idx_posts_user_created_at_id ON posts(user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_posts_user_id;
+
+-- Заполняем таймлайны уже существующими постами обычных авторов
+INSERT INTO timelines (user_id, post_id, created_at)
+SELECT s.follower_id, p.id, p.created_at
+FROM posts p
+JOIN subscriptions s ON s.following_id = p.user_id
+JOIN users u ON u.id = p.user_id AND NOT u.fanout_on_read
+WHERE p.created_at IS NOT NULL
+UNION ALL
+SELECT p.user_id, p.id, p.created_at
+FROM posts p
+WHERE p.created_at IS NOT NULL
+ON CONFLICT DO NOTHING;
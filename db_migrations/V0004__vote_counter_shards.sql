@@ -0,0 +1,21 @@
+-- Шардированные дельты счётчиков лайков: голоса за один пост/клип распределяются
+-- по нескольким строкам и периодически сворачиваются в posts/shorts
+CREATE TABLE IF NOT EXISTS post_counter_shards (
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    shard SMALLINT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    dislikes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (post_id, shard)
+);
+
+CREATE TABLE IF NOT EXISTS short_counter_shards (
+    short_id INTEGER NOT NULL REFERENCES shorts(id),
+    shard SMALLINT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    dislikes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (short_id, shard)
+);
+
+-- Индексы для пересчёта счётчиков по таблицам голосов
+CREATE INDEX IF NOT EXISTS idx_post_likes_post_id ON post_likes(post_id);
+CREATE INDEX IF NOT EXISTS idx_short_likes_short_id ON short_likes(short_id);
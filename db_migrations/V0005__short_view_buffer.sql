@@ -0,0 +1,16 @@
+-- Буфер просмотров клипов: нежурналируемая таблица без WAL, сворачивается
+-- в shorts.views пачками задачей flush-views. При сбое БД теряются только
+-- ещё не свёрнутые просмотры.
+CREATE UNLOGGED TABLE IF NOT EXISTS short_view_buffer (
+    short_id INTEGER NOT NULL,
+    viewer_key TEXT,
+    viewed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    flushed BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- Дедупликация повторных просмотров одним зрителем (пока строка в окне)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_short_view_buffer_viewer
+    ON short_view_buffer(short_id, viewer_key) WHERE viewer_key IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_short_view_buffer_pending
+    ON short_view_buffer(short_id) WHERE NOT flushed;
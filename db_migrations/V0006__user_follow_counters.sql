@@ -0,0 +1,7 @@
+-- Денормализованные счётчики подписок вместо COUNT(*) по subscriptions в verify
+ALTER TABLE users ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users u SET
+    followers_count = (SELECT COUNT(*) FROM subscriptions WHERE following_id = u.id),
+    following_count = (SELECT COUNT(*) FROM subscriptions WHERE follower_id = u.id);
@@ -0,0 +1,40 @@
+-- Рейтинг "в тренде": сумма событий с весом, который удваивается каждые 24 часа
+-- новизны. Хранится в логарифмической шкале, поэтому не переполняется, а
+-- порядок по нему совпадает с порядком по затухающему со временем рейтингу.
+CREATE OR REPLACE FUNCTION trend_point(weight DOUBLE PRECISION, at TIMESTAMP) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT ln(weight) + EXTRACT(EPOCH FROM at)::DOUBLE PRECISION / 86400.0 * ln(2.0)
+$$;
+
+-- Сложение двух рейтингов в логарифмической шкале, NULL означает "нет событий"
+CREATE OR REPLACE FUNCTION trend_add(a DOUBLE PRECISION, b DOUBLE PRECISION) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN a IS NULL THEN b
+        WHEN b IS NULL THEN a
+        ELSE GREATEST(a, b) + ln(1.0 + exp(-abs(a - b)))
+    END
+$$;
+
+CREATE OR REPLACE AGGREGATE trend_sum(DOUBLE PRECISION) (
+    SFUNC = trend_add,
+    STYPE = DOUBLE PRECISION
+);
+
+-- Публикация считается первым событием с весом 1: свежее без реакций тоже видно
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS trend_score DOUBLE PRECISION NOT NULL
+    DEFAULT trend_point(1, CURRENT_TIMESTAMP::TIMESTAMP);
+ALTER TABLE shorts ADD COLUMN IF NOT EXISTS trend_score DOUBLE PRECISION NOT NULL
+    DEFAULT trend_point(1, CURRENT_TIMESTAMP::TIMESTAMP);
+
+-- Накопленные реакции уже существующих записей относим ко времени публикации
+UPDATE posts SET trend_score = trend_point(1 + likes + views * 0.1, COALESCE(created_at, CURRENT_TIMESTAMP::TIMESTAMP));
+UPDATE shorts SET trend_score = trend_point(1 + likes + views * 0.1, COALESCE(created_at, CURRENT_TIMESTAMP::TIMESTAMP));
+
+-- Приросты рейтинга от лайков копятся в шардах вместе со счётчиками
+ALTER TABLE post_counter_shards ADD COLUMN IF NOT EXISTS trend DOUBLE PRECISION;
+ALTER TABLE short_counter_shards ADD COLUMN IF NOT EXISTS trend DOUBLE PRECISION;
+
+-- Топ ленты "в тренде" и keyset-пагинация по (trend_score, id)
+CREATE INDEX IF NOT EXISTS idx_posts_trend_score_id ON posts(trend_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_shorts_trend_score_id ON shorts(trend_score DESC, id DESC);
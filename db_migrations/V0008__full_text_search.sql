@@ -0,0 +1,14 @@
+-- Полнотекстовый поиск: вектор считается самой БД при вставке и обновлении,
+-- конфигурация russian даёт стемминг русских слов (латиница идёт через english)
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('russian', content)) STORED;
+ALTER TABLE shorts ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('russian', title)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_posts_search_vector ON posts USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_shorts_search_vector ON shorts USING GIN (search_vector);
+
+-- Поиск пользователей по началу имени без учёта регистра
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (lower(username) gin_trgm_ops);
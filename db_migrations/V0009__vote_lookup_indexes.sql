@@ -0,0 +1,4 @@
+-- Голоса пользователя по странице ленты (myVote) читаются index-only scan:
+-- is_like лежит прямо в индексе и в таблицу заходить не нужно
+CREATE INDEX IF NOT EXISTS idx_post_likes_user_post ON post_likes(user_id, post_id) INCLUDE (is_like);
+CREATE INDEX IF NOT EXISTS idx_short_likes_user_short ON short_likes(user_id, short_id) INCLUDE (is_like);
@@ -0,0 +1,10 @@
+-- Снимки первых страниц анонимных лент: готовый JSON и его сжатые версии.
+-- Функции отдают их как есть, без запроса ленты и сериализации
+CREATE TABLE IF NOT EXISTS feed_snapshots (
+    name VARCHAR(50) PRIMARY KEY,
+    etag VARCHAR(50) NOT NULL,
+    body BYTEA NOT NULL,
+    body_gzip BYTEA NOT NULL,
+    body_br BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,90 @@
+-- Таблицы голосов секционируются диапазонами id записи: голоса одной записи
+-- лежат в одной секции, уникальность (user_id, id записи) сохраняется, а
+-- поиск голосов страницы ленты (= ANY) отсекает все секции, кроме свежих.
+-- Секции старых записей отсоединяются maintenance и перестают участвовать
+-- в индексах и очистке основной таблицы.
+CREATE OR REPLACE FUNCTION vote_partition_size() RETURNS BIGINT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT 100000::BIGINT
+$$;
+
+-- Создать недостающие секции <parent>_p<N> вплоть до записи upto.
+-- Строки, успевшие попасть в секцию по умолчанию, переносятся в новую секцию.
+-- Отсоединённые секции остаются отдельными таблицами и не пересоздаются.
+CREATE OR REPLACE FUNCTION ensure_vote_partitions(parent TEXT, item_key TEXT, upto BIGINT) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    size BIGINT := vote_partition_size();
+    created INTEGER := 0;
+    partition TEXT;
+BEGIN
+    FOR bucket IN 0 .. upto / size LOOP
+        partition := parent || '_p' || bucket;
+        CONTINUE WHEN to_regclass(partition) IS NOT NULL;
+        
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition, parent);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %I WHERE %I >= %s AND %I < %s RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            parent || '_default', item_key, bucket * size, item_key, (bucket + 1) * size, partition
+        );
+        EXECUTE format(
+            'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+            parent, partition, bucket * size, (bucket + 1) * size
+        );
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+-- Голоса за записи с id ниже archived_below лежат в отсоединённых секциях:
+-- такие записи больше не принимают голоса, а их счётчики не пересчитываются
+CREATE TABLE IF NOT EXISTS vote_archive_bounds (
+    table_name VARCHAR(50) PRIMARY KEY,
+    archived_below INTEGER NOT NULL
+);
+
+-- post_likes: суррогатный id не использовался, ключом становится (user_id, post_id)
+ALTER TABLE post_likes RENAME TO post_likes_unpartitioned;
+
+CREATE TABLE post_likes (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    is_like BOOLEAN NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT post_likes_user_post_pkey PRIMARY KEY (user_id, post_id) INCLUDE (is_like)
+) PARTITION BY RANGE (post_id);
+
+CREATE TABLE post_likes_default PARTITION OF post_likes DEFAULT;
+
+SELECT ensure_vote_partitions('post_likes', 'post_id', (SELECT COALESCE(MAX(id), 0) FROM posts) + vote_partition_size());
+
+INSERT INTO post_likes (user_id, post_id, is_like, created_at)
+SELECT user_id, post_id, is_like, created_at FROM post_likes_unpartitioned;
+
+DROP TABLE post_likes_unpartitioned;
+
+-- Первичный ключ с is_like заменяет покрывающий индекс из V0009
+CREATE INDEX IF NOT EXISTS idx_post_likes_post_id ON post_likes(post_id);
+
+-- short_likes: то же самое
+ALTER TABLE short_likes RENAME TO short_likes_unpartitioned;
+
+CREATE TABLE short_likes (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    short_id INTEGER NOT NULL REFERENCES shorts(id),
+    is_like BOOLEAN NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT short_likes_user_short_pkey PRIMARY KEY (user_id, short_id) INCLUDE (is_like)
+) PARTITION BY RANGE (short_id);
+
+CREATE TABLE short_likes_default PARTITION OF short_likes DEFAULT;
+
+SELECT ensure_vote_partitions('short_likes', 'short_id', (SELECT COALESCE(MAX(id), 0) FROM shorts) + vote_partition_size());
+
+INSERT INTO short_likes (user_id, short_id, is_like, created_at)
+SELECT user_id, short_id, is_like, created_at FROM short_likes_unpartitioned;
+
+DROP TABLE short_likes_unpartitioned;
+
+CREATE INDEX IF NOT EXISTS idx_short_likes_short_id ON short_likes(short_id);
@@ -0,0 +1,8 @@
+-- Имя и почта уникальны без учёта регистра: регистрация опирается на эти
+-- индексы через ON CONFLICT, вход ищет пользователя по одному из них
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower ON users (lower(username));
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower ON users (lower(email));
+
+-- Регистрозависимые ограничения из V0001 строже не делают, а индекс на вставку добавляют
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_username_key;
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_email_key;
@@ -0,0 +1,30 @@
+-- Журнал изменений лент для delta-запросов: create, like и flush-views
+-- дописывают id записи, у которой поменялись поля или счётчики.
+-- Водяной знак — id транзакции (xid8): в отличие от времени и BIGSERIAL,
+-- xmin снимка гарантирует, что все транзакции до него уже видны, поэтому
+-- медленный коммит не проскочит мимо клиента.
+CREATE TABLE IF NOT EXISTS post_changes (
+    post_id INTEGER NOT NULL,
+    created BOOLEAN NOT NULL DEFAULT FALSE,
+    txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS short_changes (
+    short_id INTEGER NOT NULL,
+    created BOOLEAN NOT NULL DEFAULT FALSE,
+    txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_post_changes_txid ON post_changes(txid) INCLUDE (post_id, created);
+CREATE INDEX IF NOT EXISTS idx_short_changes_txid ON short_changes(txid) INCLUDE (short_id, created);
+CREATE INDEX IF NOT EXISTS idx_post_changes_updated_at ON post_changes(updated_at);
+CREATE INDEX IF NOT EXISTS idx_short_changes_updated_at ON short_changes(updated_at);
+
+-- Граница очистки журнала задачей prune-changes: водяные знаки ниже неё
+-- уже не восстановить, такой клиент перечитывает первую страницу ленты
+CREATE TABLE IF NOT EXISTS change_log_bounds (
+    table_name VARCHAR(50) PRIMARY KEY,
+    pruned_below xid8 NOT NULL
+);
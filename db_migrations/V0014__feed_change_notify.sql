@@ -0,0 +1,23 @@
+-- Push-доставка изменений лент: журналы post_changes и short_changes служат
+-- outbox, а триггер будит сервис realtime через NOTIFY feed_changes с именем
+-- ленты. Сами изменения сервис дочитывает из журнала, поэтому полезная
+-- нагрузка не упирается в предел NOTIFY. Одинаковые уведомления одной
+-- транзакции Postgres схлопывает в одно и отправляет при коммите.
+CREATE OR REPLACE FUNCTION notify_feed_change() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM inserted) THEN
+        PERFORM pg_notify('feed_changes', TG_ARGV[0]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS post_changes_notify ON post_changes;
+CREATE TRIGGER post_changes_notify
+    AFTER INSERT ON post_changes REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_feed_change('posts');
+
+DROP TRIGGER IF EXISTS short_changes_notify ON short_changes;
+CREATE TRIGGER short_changes_notify
+    AFTER INSERT ON short_changes REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_feed_change('shorts');
@@ -0,0 +1,12 @@
+-- Прирост рейтинга за лайк засчитывается один раз на пару (пользователь, запись).
+-- Рейтинг хранится в логарифмической шкале и не умеет вычитать, поэтому
+-- снятый голос не удаляется, а остаётся строкой с is_like = NULL, а флаг
+-- trended помнит, что лайк уже поднял рейтинг: иначе лайк -> снять -> лайк
+-- накручивал бы тренд без ограничений.
+ALTER TABLE post_likes ALTER COLUMN is_like DROP NOT NULL;
+ALTER TABLE post_likes ADD COLUMN IF NOT EXISTS trended BOOLEAN NOT NULL DEFAULT FALSE;
+UPDATE post_likes SET trended = TRUE WHERE is_like;
+
+ALTER TABLE short_likes ALTER COLUMN is_like DROP NOT NULL;
+ALTER TABLE short_likes ADD COLUMN IF NOT EXISTS trended BOOLEAN NOT NULL DEFAULT FALSE;
+UPDATE short_likes SET trended = TRUE WHERE is_like;
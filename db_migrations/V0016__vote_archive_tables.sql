@@ -0,0 +1,32 @@
+-- Архивные секции голосов собираются в отдельные секционированные таблицы
+-- <votes>_archive: они по-прежнему не входят в индексы и очистку основной
+-- таблицы, но голос пользователя за старую запись (myVote) читается одним
+-- запросом с отсечением секций, а не теряется вместе с секцией.
+CREATE TABLE IF NOT EXISTS post_likes_archive (LIKE post_likes) PARTITION BY RANGE (post_id);
+CREATE TABLE IF NOT EXISTS short_likes_archive (LIKE short_likes) PARTITION BY RANGE (short_id);
+
+-- Секции, отсоединённые до этой миграции, подключаются к архиву. Колонки
+-- из V0015 на них не распространялись и добавляются здесь.
+DO $$
+DECLARE
+    size BIGINT := vote_partition_size();
+    bound RECORD;
+    partition TEXT;
+BEGIN
+    FOR bound IN SELECT table_name, archived_below FROM vote_archive_bounds LOOP
+        FOR bucket IN 0 .. bound.archived_below / size - 1 LOOP
+            partition := bound.table_name || '_p' || bucket;
+            CONTINUE WHEN to_regclass(partition) IS NULL
+                OR EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = partition::regclass);
+
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN is_like DROP NOT NULL', partition);
+            EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS trended BOOLEAN NOT NULL DEFAULT FALSE', partition);
+            EXECUTE format('UPDATE %I SET trended = TRUE WHERE is_like', partition);
+            EXECUTE format(
+                'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+                bound.table_name || '_archive', partition, bucket * size, (bucket + 1) * size
+            );
+        END LOOP;
+    END LOOP;
+END
+$$;
@@ -0,0 +1,303 @@
+"""Сервис push-доставки изменений лент: LISTEN feed_changes -> SSE.
+
+    python realtime/server.py --database-url postgresql://... --port 8080
+
+Функции posts и shorts пишут изменения в журналы post_changes и
+short_changes (create, like, flush-views), триггер на журналах шлёт
+NOTIFY feed_changes с именем ленты. Сервис дочитывает журнал от своего
+водяного знака и рассылает результат подключённым клиентам:
+
+    GET /posts, GET /shorts  ->  text/event-stream
+
+Первое событие hello несёт текущий водяной знак, остальные — JSON в
+формате ответа delta= функций: новые записи целиком, changes со
+счётчиками [id, likes, dislikes, views] и watermark. Пропуск между
+первой страницей ленты и подключением клиент добирает одним delta=.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime
+
+import asyncpg
+
+COALESCE_DELAY = float(os.environ.get('REALTIME_COALESCE_DELAY', '0.25'))
+POLL_INTERVAL = float(os.environ.get('REALTIME_POLL_INTERVAL', '5'))
+DELTA_MAX_ITEMS = int(os.environ.get('DELTA_MAX_ITEMS', '200'))
+CLIENT_MAX_PENDING = int(os.environ.get('REALTIME_CLIENT_MAX_PENDING', '500'))
+CLIENT_SEND_TIMEOUT = float(os.environ.get('REALTIME_CLIENT_SEND_TIMEOUT', '10'))
+HEARTBEAT_INTERVAL = float(os.environ.get('REALTIME_HEARTBEAT_INTERVAL', '15'))
+LISTEN_CHECK_INTERVAL = float(os.environ.get('REALTIME_LISTEN_CHECK_INTERVAL', '30'))
+LISTEN_RETRY_DELAY = float(os.environ.get('REALTIME_LISTEN_RETRY_DELAY', '1'))
+
+# Поля элементов те же, что в POST_FIELDS и SHORT_FIELDS функций
+FEEDS = {
+    'posts': """
+        SELECT p.id, p.content, p.post_type AS "type", p.media_url AS "mediaUrl",
+               p.video_url AS "videoUrl", p.thumbnail_url AS "thumbnailUrl", p.mod_link AS "modLink",
+               p.likes + COALESCE(shards.likes, 0) AS likes,
+               p.dislikes + COALESCE(shards.dislikes, 0) AS dislikes,
+               p.views, p.created_at AS "timestamp", p.user_id AS "authorId", c.created
+        FROM (
+            SELECT post_id, bool_or(created) AS created FROM post_changes
+            WHERE txid >= $1::text::xid8
+            GROUP BY post_id
+        ) c
+        JOIN posts p ON p.id = c.post_id
+        LEFT JOIN LATERAL (
+            SELECT SUM(likes) AS likes, SUM(dislikes) AS dislikes
+            FROM post_counter_shards WHERE post_id = p.id
+        ) shards ON TRUE
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT $2
+    """,
+    'shorts': """
+        SELECT s.id, s.title, s.video_url AS "videoUrl", s.thumbnail_url AS "thumbnailUrl", s.duration,
+               s.likes + COALESCE(shards.likes, 0) AS likes,
+               s.dislikes + COALESCE(shards.dislikes, 0) AS dislikes,
+               s.views, s.created_at AS "timestamp", s.user_id AS "authorId", c.created
+        FROM (
+            SELECT short_id, bool_or(created) AS created FROM short_changes
+            WHERE txid >= $1::text::xid8
+            GROUP BY short_id
+        ) c
+        JOIN shorts s ON s.id = c.short_id
+        LEFT JOIN LATERAL (
+            SELECT SUM(likes) AS likes, SUM(dislikes) AS dislikes
+            FROM short_counter_shards WHERE short_id = s.id
+        ) shards ON TRUE
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT $2
+    """,
+}
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def sse(data: dict, event: str = None) -> bytes:
+    head = f'event: {event}\n' if event else ''
+    return (head + 'data: ' + json.dumps(data, ensure_ascii=False, default=_json_default) + '\n\n').encode('utf-8')
+
+class Client:
+    """Подключение SSE с собственной очередью.
+
+    Очередь не копит события, а сливает их в одно: новые записи и счётчики
+    по id заменяют прежние, так что медленный клиент получает последнее
+    состояние, а не всю историю. Если слитое событие разрослось больше
+    CLIENT_MAX_PENDING записей, вместо него уходит reset.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self._pending = None
+
+    def push(self, delta: dict):
+        pending = self._pending
+        if delta.get('reset') or (pending and pending.get('reset')):
+            self._pending = {'reset': True, 'watermark': delta['watermark']}
+        elif pending is None:
+            self._pending = {
+                'items': {item['id']: item for item in delta['items']},
+                'changes': {change[0]: change for change in delta['changes']},
+                'authors': dict(delta['authors']),
+                'watermark': delta['watermark'],
+            }
+        else:
+            for item in delta['items']:
+                pending['items'][item['id']] = item
+            for change in delta['changes']:
+                item = pending['items'].get(change[0])
+                if item:
+                    item.update(zip(('likes', 'dislikes', 'views'), change[1:]))
+                else:
+                    pending['changes'][change[0]] = change
+            pending['authors'].update(delta['authors'])
+            pending['watermark'] = delta['watermark']
+            if len(pending['items']) + len(pending['changes']) > CLIENT_MAX_PENDING:
+                self._pending = {'reset': True, 'watermark': delta['watermark']}
+        self.ready.set()
+
+    def take(self, feed: str):
+        """Слитое событие для отправки в формате delta= или None"""
+        pending, self._pending = self._pending, None
+        self.ready.clear()
+        if pending is None or pending.get('reset'):
+            return pending
+        return {
+            feed: list(pending['items'].values()),
+            'changes': list(pending['changes'].values()),
+            'authors': pending['authors'],
+            'watermark': pending['watermark'],
+        }
+
+    async def send(self, data: bytes):
+        """Записать и дождаться, пока сокет примет данные: пока клиент не читает, события сливаются"""
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), CLIENT_SEND_TIMEOUT)
+
+class Feed:
+    """Лента с журналом изменений, водяным знаком и подключёнными клиентами"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.sql = FEEDS[name]
+        self.watermark = None
+        self.clients = set()
+        self.dirty = asyncio.Event()
+
+    async def read_delta(self, conn) -> dict:
+        """Изменения с текущего водяного знака тем же способом, что delta= в функциях"""
+        next_watermark = await conn.fetchval("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+        rows = await conn.fetch(self.sql, self.watermark, DELTA_MAX_ITEMS + 1)
+        self.watermark = next_watermark
+        if len(rows) > DELTA_MAX_ITEMS:
+            return {'reset': True, 'watermark': next_watermark}
+
+        items, changes = [], []
+        for row in rows:
+            if row['created']:
+                items.append({key: value for key, value in row.items() if key != 'created' and value is not None})
+            else:
+                changes.append([row['id'], row['likes'], row['dislikes'], row['views']])
+        authors = {}
+        if items:
+            users = await conn.fetch("SELECT id, username, avatar FROM users WHERE id = ANY($1)", list({item['authorId'] for item in items}))
+            authors = {str(user['id']): dict(user) for user in users}
+        return {'items': items, 'changes': changes, 'authors': authors, 'watermark': next_watermark}
+
+    async def run(self, pool: asyncpg.Pool):
+        """Ждать NOTIFY, копить изменения COALESCE_DELAY секунд и рассылать.
+        
+        Раз в POLL_INTERVAL журнал читается и без уведомления: так не теряются
+        изменения, пришедшие, пока слушающее соединение переподключалось.
+        """
+        async with pool.acquire() as conn:
+            self.watermark = await conn.fetchval("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+        while True:
+            try:
+                await asyncio.wait_for(self.dirty.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(COALESCE_DELAY)
+            self.dirty.clear()
+            try:
+                async with pool.acquire() as conn:
+                    delta = await self.read_delta(conn)
+            except (asyncpg.PostgresError, OSError) as e:
+                print(json.dumps({'type': 'error', 'feed': self.name, 'error': str(e)}), flush=True)
+                continue
+            if delta.get('reset') or delta['items'] or delta['changes']:
+                for client in self.clients:
+                    client.push(delta)
+
+async def serve_client(feed: Feed, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    client = Client(writer)
+    feed.clients.add(client)
+    try:
+        await client.send(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream\r\n'
+            b'Cache-Control: no-cache\r\n'
+            b'Access-Control-Allow-Origin: *\r\n'
+            b'Connection: keep-alive\r\n\r\n'
+            b'retry: 3000\n\n' + sse({'watermark': feed.watermark}, 'hello')
+        )
+        last_sent = time.monotonic()
+        while not reader.at_eof():
+            try:
+                await asyncio.wait_for(client.ready.wait(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            delta = client.take(feed.name)
+            if delta is not None:
+                await client.send(sse(delta))
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                # Комментарий SSE не даёт прокси закрыть простаивающее соединение
+                await client.send(b': ping\n\n')
+                last_sent = time.monotonic()
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    finally:
+        feed.clients.discard(client)
+        writer.close()
+
+async def handle(feeds: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Минимальный HTTP: GET /<лента> открывает поток, всё остальное — 404"""
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+    except (ConnectionError, ValueError):
+        writer.close()
+        return
+
+    path = request_line[1].split('?', 1)[0].strip('/') if len(request_line) >= 2 else ''
+    if request_line[:1] != ['GET'] or path not in feeds:
+        writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        writer.close()
+        return
+    await serve_client(feeds[path], reader, writer)
+
+async def listen(database_url: str, feeds: dict):
+    """Держать LISTEN feed_changes и переподключаться, когда соединение рвётся.
+    
+    Обрыв замечает termination listener, а тихо пропавшую сеть — проверочный
+    запрос раз в LISTEN_CHECK_INTERVAL секунд. После каждого подключения все
+    ленты помечаются изменёнными: уведомления, пришедшие без слушателя,
+    потеряны, и журнал нужно дочитать, не дожидаясь POLL_INTERVAL.
+    """
+    def notify(conn, pid, channel, payload):
+        if payload in feeds:
+            feeds[payload].dirty.set()
+    
+    while True:
+        lost = asyncio.Event()
+        conn, error = None, None
+        try:
+            conn = await asyncpg.connect(database_url)
+            conn.add_termination_listener(lambda _: lost.set())
+            await conn.add_listener('feed_changes', notify)
+            for feed in feeds.values():
+                feed.dirty.set()
+            print(json.dumps({'type': 'listen'}), flush=True)
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), LISTEN_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(conn.fetchval("SELECT 1"), LISTEN_CHECK_INTERVAL)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as e:
+            error = str(e) or type(e).__name__
+        finally:
+            if conn is not None:
+                conn.terminate()
+        print(json.dumps({'type': 'listen_lost', 'error': error}), flush=True)
+        await asyncio.sleep(LISTEN_RETRY_DELAY)
+
+async def main(args):
+    pool = await asyncpg.create_pool(args.database_url, min_size=1, max_size=len(FEEDS))
+    feeds = {name: Feed(name) for name in FEEDS}
+    
+    server = await asyncio.start_server(lambda r, w: handle(feeds, r, w), args.host, args.port)
+    print(json.dumps({'type': 'start', 'host': args.host, 'port': args.port}), flush=True)
+    async with server:
+        await asyncio.gather(
+            server.serve_forever(),
+            listen(args.database_url, feeds),
+            *(feed.run(pool) for feed in feeds.values())
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8080')))
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    asyncio.run(main(args))
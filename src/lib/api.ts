@@ -6,6 +6,9 @@ const API_URLS = {
   shorts: funcUrls.shorts,
 };
 
+// Сервис realtime (push изменений лент по SSE); без него клиент опрашивает delta=
+const REALTIME_URL: string | undefined = import.meta.env.VITE_REALTIME_URL;
+
 export interface User {
   id: number;
   username: string;
@@ -18,6 +21,22 @@ export interface User {
   following?: number;
 }
 
+export interface Author {
+  id: number;
+  username: string;
+  avatar: string;
+}
+
+export interface UserSummary extends Author {
+  followers: number;
+}
+
+export interface SearchPage<T> {
+  items: T[];
+  nextCursor: string | null;
+  hasMore: boolean;
+}
+
 export interface Post {
   id: number;
   content: string;
@@ -30,11 +49,8 @@ export interface Post {
   dislikes: number;
   views: number;
   timestamp: string;
-  author: {
-    id: number;
-    username: string;
-    avatar: string;
-  };
+  author: Author;
+  myVote?: boolean;
 }
 
 export interface Short {
@@ -47,11 +63,63 @@ export interface Short {
   dislikes: number;
   views: number;
   timestamp: string;
-  author: {
-    id: number;
-    username: string;
-    avatar: string;
+  author: Author;
+  myVote?: boolean;
+}
+
+export type PostBatchItem =
+  | { action: 'like'; postId: number; isLike: boolean | null }
+  | { action: 'create'; content: string; type?: string; videoUrl?: string; mediaUrl?: string; modLink?: string };
+
+export type ShortBatchItem =
+  | { action: 'view'; shortId: number }
+  | { action: 'like'; shortId: number; isLike: boolean | null }
+  | { action: 'create'; title: string; videoUrl: string; thumbnailUrl?: string; duration?: number };
+
+export interface BatchResult {
+  status: number;
+  error?: string;
+  likes?: number;
+  dislikes?: number;
+  accepted?: boolean;
+  post?: Post;
+  short?: Short;
+}
+
+// Ответ delta=: новые записи целиком, у остальных изменённых только счётчики.
+// reset означает, что водяной знак устарел и первую страницу нужно перечитать
+export interface FeedDelta<T> {
+  items: T[];
+  changes: [id: number, likes: number, dislikes: number, views: number][];
+  watermark: string;
+  reset: boolean;
+}
+
+type FeedItem<T> = Omit<T, 'author'> & { authorId: number };
+
+// Лента приходит с авторами отдельным словарём (authors=map), собираем обратно
+function withAuthors<T extends { author: Author }>(items: FeedItem<T>[] = [], authors: Record<string, Author> = {}): T[] {
+  return items.map(({ authorId, ...item }) => ({ ...item, author: authors[authorId] }) as unknown as T);
+}
+
+// Влить delta в загруженную ленту: новые записи наверх без повторов, счётчики на место
+export function applyDelta<T extends { id: number; likes: number; dislikes: number; views: number }>(items: T[], delta: FeedDelta<T>): T[] {
+  const changes = new Map(delta.changes.map(([id, likes, dislikes, views]) => [id, { likes, dislikes, views }]));
+  const fresh = delta.items.filter((item) => !items.some((existing) => existing.id === item.id));
+  return [...fresh, ...items.map((item) => (changes.has(item.id) ? { ...item, ...changes.get(item.id) } : item))];
+}
+
+// Подписка на изменения ленты через realtime: события приходят в формате delta=.
+// После подключения клиент один раз добирает delta= от водяного знака своей
+// первой страницы. Возвращает отписку или null, если сервис не настроен
+export function subscribeFeed<T extends { author: Author }>(feed: 'posts' | 'shorts', onDelta: (delta: FeedDelta<T>) => void): (() => void) | null {
+  if (!REALTIME_URL || typeof EventSource === 'undefined') return null;
+  const source = new EventSource(`${REALTIME_URL}/${feed}`);
+  source.onmessage = (event) => {
+    const data = JSON.parse(event.data);
+    onDelta({ items: withAuthors<T>(data[feed], data.authors), changes: data.changes || [], watermark: data.watermark, reset: !!data.reset });
   };
+  return () => source.close();
 }
 
 function getAuthHeaders() {
@@ -59,6 +127,46 @@ function getAuthHeaders() {
   return token ? { Authorization: `Bearer ${token}` } : {};
 }
 
+// Для вошедшего пользователя лента приходит с его голосами (myVote)
+function feedParams(sort?: string) {
+  const params = new URLSearchParams({ authors: 'map', ...(sort ? { sort } : {}) });
+  if (localStorage.getItem('authToken')) params.set('votes', 'mine');
+  return params;
+}
+
+async function sendBatch<T>(url: string, items: T[], keepalive = false): Promise<BatchResult[]> {
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 
+      'Content-Type': 'application/json',
+      ...getAuthHeaders()
+    },
+    body: JSON.stringify({ action: 'batch', items }),
+    keepalive,
+  });
+  const data = await response.json();
+  return data.results || [];
+}
+
+// Просмотры клипов копятся и уходят одним batch-запросом
+const VIEW_FLUSH_SIZE = 20;
+const VIEW_FLUSH_DELAY = 2000;
+let pendingViews: number[] = [];
+let viewFlushTimer: ReturnType<typeof setTimeout> | undefined;
+
+function flushViews(keepalive = false) {
+  clearTimeout(viewFlushTimer);
+  viewFlushTimer = undefined;
+  if (!pendingViews.length) return;
+  const items = pendingViews.map((shortId) => ({ action: 'view' as const, shortId }));
+  pendingViews = [];
+  sendBatch<ShortBatchItem>(API_URLS.shorts, items, keepalive).catch(() => undefined);
+}
+
+if (typeof window !== 'undefined') {
+  window.addEventListener('pagehide', () => flushViews(true));
+}
+
 export const auth = {
   async register(username: string, email: string, password: string) {
     const response = await fetch(API_URLS.auth, {
@@ -108,16 +216,66 @@ export const auth = {
     return { ok: false };
   },
 
+  async subscribe(userId: number) {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 
+        'Content-Type': 'application/json',
+        ...getAuthHeaders()
+      },
+      body: JSON.stringify({ action: 'subscribe', userId }),
+    });
+    return await response.json();
+  },
+
+  async unsubscribe(userId: number) {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 
+        'Content-Type': 'application/json',
+        ...getAuthHeaders()
+      },
+      body: JSON.stringify({ action: 'unsubscribe', userId }),
+    });
+    return await response.json();
+  },
+
+  async searchUsers(query: string, cursor?: string): Promise<SearchPage<UserSummary>> {
+    const params = new URLSearchParams({ q: query, ...(cursor ? { cursor } : {}) });
+    const response = await fetch(`${API_URLS.auth}?${params}`);
+    const data = await response.json();
+    return { items: data.users || [], nextCursor: data.nextCursor ?? null, hasMore: !!data.hasMore };
+  },
+
   logout() {
     localStorage.removeItem('authToken');
   },
 };
 
 export const posts = {
-  async getFeed(): Promise<Post[]> {
-    const response = await fetch(API_URLS.posts);
+  async getFeed(sort?: 'trending'): Promise<Post[]> {
+    return (await posts.getFeedPage(sort)).items;
+  },
+
+  // Первая страница общей ленты вместе с водяным знаком для getDelta
+  async getFeedPage(sort?: 'trending'): Promise<{ items: Post[]; watermark?: string }> {
+    const response = await fetch(`${API_URLS.posts}?${feedParams(sort)}`, { headers: getAuthHeaders() });
+    const data = await response.json();
+    return { items: withAuthors<Post>(data.posts, data.authors), watermark: data.watermark };
+  },
+
+  async getDelta(watermark: string): Promise<FeedDelta<Post>> {
+    const params = new URLSearchParams({ delta: watermark, authors: 'map' });
+    const response = await fetch(`${API_URLS.posts}?${params}`);
     const data = await response.json();
-    return data.posts || [];
+    return { items: withAuthors<Post>(data.posts, data.authors), changes: data.changes || [], watermark: data.watermark, reset: !!data.reset };
+  },
+
+  async search(query: string, cursor?: string): Promise<SearchPage<Post>> {
+    const params = new URLSearchParams({ q: query, authors: 'map', ...(cursor ? { cursor } : {}) });
+    const response = await fetch(`${API_URLS.posts}?${params}`);
+    const data = await response.json();
+    return { items: withAuthors<Post>(data.posts, data.authors), nextCursor: data.nextCursor ?? null, hasMore: !!data.hasMore };
   },
 
   async create(content: string, type: string = 'text', videoUrl?: string, mediaUrl?: string, modLink?: string) {
@@ -140,6 +298,10 @@ export const posts = {
     return { ok: response.ok, post: data.post };
   },
 
+  async batch(items: PostBatchItem[]): Promise<BatchResult[]> {
+    return sendBatch(API_URLS.posts, items);
+  },
+
   async like(postId: number, isLike: boolean = true) {
     const response = await fetch(API_URLS.posts, {
       method: 'POST',
@@ -154,10 +316,29 @@ export const posts = {
 };
 
 export const shorts = {
-  async getFeed(): Promise<Short[]> {
-    const response = await fetch(API_URLS.shorts);
+  async getFeed(sort?: 'trending'): Promise<Short[]> {
+    return (await shorts.getFeedPage(sort)).items;
+  },
+
+  // Первая страница общей ленты вместе с водяным знаком для getDelta
+  async getFeedPage(sort?: 'trending'): Promise<{ items: Short[]; watermark?: string }> {
+    const response = await fetch(`${API_URLS.shorts}?${feedParams(sort)}`, { headers: getAuthHeaders() });
+    const data = await response.json();
+    return { items: withAuthors<Short>(data.shorts, data.authors), watermark: data.watermark };
+  },
+
+  async getDelta(watermark: string): Promise<FeedDelta<Short>> {
+    const params = new URLSearchParams({ delta: watermark, authors: 'map' });
+    const response = await fetch(`${API_URLS.shorts}?${params}`);
     const data = await response.json();
-    return data.shorts || [];
+    return { items: withAuthors<Short>(data.shorts, data.authors), changes: data.changes || [], watermark: data.watermark, reset: !!data.reset };
+  },
+
+  async search(query: string, cursor?: string): Promise<SearchPage<Short>> {
+    const params = new URLSearchParams({ q: query, authors: 'map', ...(cursor ? { cursor } : {}) });
+    const response = await fetch(`${API_URLS.shorts}?${params}`);
+    const data = await response.json();
+    return { items: withAuthors<Short>(data.shorts, data.authors), nextCursor: data.nextCursor ?? null, hasMore: !!data.hasMore };
   },
 
   async create(title: string, videoUrl: string, thumbnailUrl?: string, duration: number = 0) {
@@ -201,4 +382,28 @@ export const shorts = {
       body: JSON.stringify({ action: 'view', shortId }),
     });
   },
+
+  async viewBatch(shortIds: number[]) {
+    await fetch(API_URLS.shorts, {
+      method: 'POST',
+      headers: { 
+        'Content-Type': 'application/json',
+        ...getAuthHeaders()
+      },
+      body: JSON.stringify({ action: 'view', shortIds }),
+    });
+  },
+
+  queueView(shortId: number) {
+    pendingViews.push(shortId);
+    if (pendingViews.length >= VIEW_FLUSH_SIZE) {
+      flushViews();
+    } else if (!viewFlushTimer) {
+      viewFlushTimer = setTimeout(() => flushViews(), VIEW_FLUSH_DELAY);
+    }
+  },
+
+  async batch(items: ShortBatchItem[]): Promise<BatchResult[]> {
+    return sendBatch(API_URLS.shorts, items);
+  },
 };
\ No newline at end of file
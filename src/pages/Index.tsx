@@ -113,14 +113,14 @@ const Index = () => {
   const handleLikePost = async (postId: number, isLike: boolean) => {
     const result = await posts.like(postId, isLike);
     setFeedPosts(feedPosts.map(p => 
-      p.id === postId ? { ...p, likes: result.likes, dislikes: result.dislikes } : p
+      p.id === postId ? { ...p, likes: result.likes, dislikes: result.dislikes, myVote: isLike } : p
     ));
   };
 
   const handleLikeShort = async (shortId: number, isLike: boolean) => {
     const result = await shorts.like(shortId, isLike);
     setShortsFeed(shortsFeed.map(s => 
-      s.id === shortId ? { ...s, likes: result.likes, dislikes: result.dislikes } : s
+      s.id === shortId ? { ...s, likes: result.likes, dislikes: result.dislikes, myVote: isLike } : s
     ));
   };
 
@@ -329,7 +329,7 @@ const Index = () => {
                             variant="ghost"
                             size="sm"
                             onClick={() => handleLikePost(post.id, true)}
-                            className="text-primary hover:bg-primary/20"
+                            className={`text-primary hover:bg-primary/20 ${post.myVote === true ? 'bg-primary/20' : ''}`}
                           >
                             <Icon name="ThumbsUp" className="mr-2" size={18} />
                             {post.likes}
@@ -338,7 +338,7 @@ const Index = () => {
                             variant="ghost"
                             size="sm"
                             onClick={() => handleLikePost(post.id, false)}
-                            className="text-destructive hover:bg-destructive/20"
+                            className={`text-destructive hover:bg-destructive/20 ${post.myVote === false ? 'bg-destructive/20' : ''}`}
                           >
                             <Icon name="ThumbsDown" className="mr-2" size={18} />
                             {post.dislikes}
@@ -425,14 +425,14 @@ const Index = () => {
                       <div className="flex items-center gap-3 text-xs text-muted-foreground">
                         <button 
                           onClick={() => handleLikeShort(short.id, true)}
-                          className="flex items-center gap-1 hover:text-primary"
+                          className={`flex items-center gap-1 hover:text-primary ${short.myVote === true ? 'text-primary' : ''}`}
                         >
                           <Icon name="ThumbsUp" size={14} />
                           {short.likes}
                         </button>
                         <button 
                           onClick={() => handleLikeShort(short.id, false)}
-                          className="flex items-center gap-1 hover:text-destructive"
+                          className={`flex items-center gap-1 hover:text-destructive ${short.myVote === false ? 'text-destructive' : ''}`}
                         >
                           <Icon name="ThumbsDown" size={14} />
                           {short.dislikes}